@@ -4,6 +4,15 @@ import discord
 
 from cog_shared.seplib.utils import Result
 
+# (before is streaming, after is streaming) -> LiveRole action. Any other combination is not a LiveRole update.
+_LIVEROLE_ACTIONS = {(False, True): True, (True, False): False}
+
+# checks return these shared, pre-built results instead of constructing a new Result on every call
+_CAN_MANAGE_ROLES = Result(success=True, value=True, error=None)
+_CANNOT_MANAGE_ROLES = Result(
+    success=False, value=False, error="This bot is not allowed to manage roles on this server."
+)
+
 
 def get_liverole_action(before: discord.Member, after: discord.Member) -> Optional[bool]:
     """
@@ -13,17 +22,17 @@ def get_liverole_action(before: discord.Member, after: discord.Member) -> Option
     :param after: Discord Member state after the update event
     :return: True/False for Add/Remove, or None if not a LiveRole update.
     """
-    if isinstance(before.activity, discord.Streaming) and isinstance(after.activity, discord.Streaming):
-        return None
-    elif isinstance(after.activity, discord.Streaming):
-        return True
-    elif isinstance(before.activity, discord.Streaming):
-        return False
-    else:
+    if before.activity is after.activity:
         return None
+    return _LIVEROLE_ACTIONS.get(
+        (type(before.activity) is discord.Streaming, type(after.activity) is discord.Streaming)
+    )
 
 
 def bot_can_manage_roles(guild: discord.Guild) -> Result[bool]:
-    if guild.me.guild_permissions.manage_roles:
-        return Result(success=True, value=True, error=None)
-    return Result(success=False, value=False, error="This bot is not allowed to manage roles on this server.")
+    """
+    Checks if the bot can manage roles in the guild.
+    :param guild: Discord Guild
+    :return: Result of the check, with error message if not successful.
+    """
+    return _CAN_MANAGE_ROLES if guild.me.guild_permissions.manage_roles else _CANNOT_MANAGE_ROLES
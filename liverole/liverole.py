@@ -1,11 +1,10 @@
 import asyncio
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 import discord
 
 from cog_shared.seplib.cog import SepCog
 from cog_shared.seplib.replies import ErrorReply
-from cog_shared.seplib.utils.queues import EditMemberRoles
 from redbot.core import Config, checks, commands
 from redbot.core.bot import Red
 from redbot.core.commands import Context
@@ -20,11 +19,26 @@ class LiveRole(SepCog, commands.Cog):
     def __init__(self, bot: Red):
         super(LiveRole, self).__init__(bot=bot)
 
-        self.edit_member_roles = EditMemberRoles(cog=self)
+        self._role_queues: Dict[int, asyncio.Queue] = {}
+        self._role_workers: Dict[int, asyncio.Task] = {}
 
         self.guild_cache: Dict = {}
+        self._role_cache: Dict[int, discord.Role] = {}
+        self._role_by_guild: Dict[int, int] = {}
+        self._member_update_listening = True
+        self._pending_modifications: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
         self._ensure_futures()
 
+    def cog_unload(self):
+        super(LiveRole, self).cog_unload()
+        for handle in self._pending_modifications.values():
+            handle.cancel()
+        self._pending_modifications = {}
+        for worker in self._role_workers.values():
+            worker.cancel()
+        self._role_workers = {}
+        self._role_queues = {}
+
     async def _init_cache(self) -> None:
         """
         Load the guild configuration of LiveRole from the database into the cache/local memory.
@@ -34,10 +48,26 @@ class LiveRole(SepCog, commands.Cog):
 
         guilds: Dict[int, Dict] = await self.config.all_guilds()
 
-        for guild_id, guild_dict in guilds.items():
-            config = guild_dict.get("config")
-            if config:
-                self.guild_cache[guild_id] = config
+        self.guild_cache = {
+            guild_id: guild_dict["config"] for guild_id, guild_dict in guilds.items() if guild_dict.get("config")
+        }
+        self._role_by_guild = {
+            guild_id: config["role"] for guild_id, config in self.guild_cache.items() if config.get("role")
+        }
+        self._sync_member_update_listener()
+
+    def _sync_member_update_listener(self) -> None:
+        """
+        Registers the member update listener only while at least one guild has LiveRole configured, so un-configured
+        deployments don't pay for dispatching every member update event to this cog.
+        :return: None
+        """
+        if self._role_by_guild and not self._member_update_listening:
+            self.bot.add_listener(self.on_member_update)
+            self._member_update_listening = True
+        elif not self._role_by_guild and self._member_update_listening:
+            self.bot.remove_listener(self.on_member_update)
+            self._member_update_listening = False
 
     def _register_config_entities(self, config: Config) -> None:
         """
@@ -55,7 +85,37 @@ class LiveRole(SepCog, commands.Cog):
         :param guild: Discord Guild
         :return: The configured LiveRole ID.
         """
-        return self.guild_cache.get(guild.id, {}).get("role")
+        return self._role_by_guild.get(guild.id)
+
+    def _get_guild_liverole(self, guild: discord.Guild) -> Optional[discord.Role]:
+        """
+        Gets the current LiveRole role object for the guild, if set, resolving and caching it on a cache miss.
+        :param guild: Discord Guild
+        :return: The configured LiveRole role, or None if not configured or the role no longer exists.
+        """
+        role = self._role_cache.get(guild.id)
+        if role is not None:
+            return role
+
+        guild_liverole_id = self._get_guild_liverole_id(guild)
+        if not guild_liverole_id:
+            return None
+        role = guild.get_role(guild_liverole_id)
+        if not role:
+            self.logger.error(f"Role with ID {guild_liverole_id} not found in Guild {guild.id}")
+            return None
+        self._role_cache[guild.id] = role
+        return role
+
+    def _invalidate_role_cache(self, role: discord.Role) -> None:
+        """
+        Removes the role from the role cache if it is the cached LiveRole of its guild.
+        :param role: Discord Role which was updated or deleted.
+        :return: None
+        """
+        cached_role = self._role_cache.get(role.guild.id)
+        if cached_role is not None and cached_role.id == role.id:
+            del self._role_cache[role.guild.id]
 
     async def _update_liverole_role(self, guild: discord.Guild, role: discord.Role):
         """
@@ -67,6 +127,9 @@ class LiveRole(SepCog, commands.Cog):
         current_config = self.guild_cache.get(guild.id, {})
         current_config["role"] = role.id
         self.guild_cache[guild.id] = current_config
+        self._role_cache[guild.id] = role
+        self._role_by_guild[guild.id] = role.id
+        self._sync_member_update_listener()
         await self.config.guild(guild).config.set(current_config)
         self.logger.info(f"Updated LiveRole for Guild {guild}|{guild.id} to {role}|{role.id}")
 
@@ -114,21 +177,122 @@ class LiveRole(SepCog, commands.Cog):
         :param after: State of the user after the update.
         :return: None
         """
+        if after.guild.id not in self._role_by_guild:
+            return
 
         action = get_liverole_action(before=before, after=after)
         if action is None:
             return
 
-        guild_liverole_id = self._get_guild_liverole_id(after.guild)
-        if not guild_liverole_id:
+        guild_liverole = self._get_guild_liverole(after.guild)
+        if not guild_liverole:
             return
-        guild_liverole = after.guild.get_role(guild_liverole_id)
 
-        if not guild_liverole:
-            self.logger.error(f"Role with ID {guild_liverole_id} not found in Guild {after.guild.id}")
+        # streaming status can flap, so only the last action seen within the interval is applied
+        key = (after.guild.id, after.id)
+        pending = self._pending_modifications.pop(key, None)
+        if pending is not None:
+            pending.cancel()
+        self._pending_modifications[key] = self.bot.loop.call_later(
+            self.ROLE_MODIFICATION_INTERVAL, self._flush_member, after, guild_liverole, action
+        )
+
+    def _flush_member(self, member: discord.Member, role: discord.Role, action: bool) -> None:
+        """
+        Queues up the final add/remove action of the role for the member once their streaming status has settled.
+        :param member: Member whose role will be modified.
+        :param role: LiveRole role of the member's guild.
+        :param action: True/False for Add/Remove.
+        :return: None
+        """
+        self._pending_modifications.pop((member.guild.id, member.id), None)
+        self._queue_role_modification(member=member, role=role, add=action)
+
+    def _queue_role_modification(self, member: discord.Member, role: discord.Role, add: bool) -> None:
+        """
+        Queues a role add/remove for the member on its guild's role queue, starting the guild's worker if needed.
+        :param member: Member whose role will be modified.
+        :param role: Role to add or remove.
+        :param add: True/False for Add/Remove.
+        :return: None
+        """
+        guild_id = member.guild.id
+        queue = self._role_queues.get(guild_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._role_queues[guild_id] = queue
+            self._role_workers[guild_id] = self.bot.loop.create_task(self._role_queue_worker(queue=queue))
+        queue.put_nowait((member, role, add))
+
+    async def _role_queue_worker(self, queue: asyncio.Queue) -> None:
+        """
+        Async future which drains a guild's role queue as soon as a debounced action lands on it, coalescing the
+        adds/removes queued by then into a single role edit per member.
+        :param queue: Role queue of the guild.
+        :return: None
+        """
+        while self == self.bot.get_cog(self.__class__.__name__):
+            queued = [await queue.get()]
+            while not queue.empty():
+                queued.append(queue.get_nowait())
+
+            for modification in self._coalesce_role_modifications(queued=queued):
+                await self._apply_modification(modification=modification)
+
+    @staticmethod
+    def _coalesce_role_modifications(queued: List[Tuple[discord.Member, discord.Role, bool]]) -> List[Modification]:
+        """
+        Collapses queued role adds/removes into one Modification per member. Later actions for the same role win.
+        :param queued: Queued (member, role, add) actions, in the order they were queued.
+        :return: List of Modifications, one per member.
+        """
+        members: Dict[int, discord.Member] = {}
+        actions: Dict[int, Dict[bool, Set[int]]] = {}
+        for member, role, add in queued:
+            members[member.id] = member
+            member_actions = actions.setdefault(member.id, {True: set(), False: set()})
+            member_actions[add].add(role.id)
+            member_actions[not add].discard(role.id)
+        return [
+            Modification(
+                member=member,
+                actions={True: frozenset(actions[member_id][True]), False: frozenset(actions[member_id][False])},
+            )
+            for member_id, member in members.items()
+        ]
+
+    async def _apply_modification(self, modification: Modification) -> None:
+        """
+        Adds/removes the coalesced roles of the member through Discord's per-role endpoints, so role changes made by
+        anyone else in the meantime are left untouched.
+        :param modification: Coalesced Modification of the member.
+        :return: None
+        """
+        member = modification.member
+        current_role_ids = {role.id for role in member.roles}
+        to_add = [discord.Object(id=role_id) for role_id in modification.actions[True] - current_role_ids]
+        to_remove = [discord.Object(id=role_id) for role_id in modification.actions[False] & current_role_ids]
+        if not to_add and not to_remove:
             return
+        try:
+            if to_add:
+                await member.add_roles(*to_add, reason="LiveRole streaming status changed.")
+            if to_remove:
+                await member.remove_roles(*to_remove, reason="LiveRole streaming status changed.")
+            self.logger.info(f"Updated LiveRole roles for Member {member}|{member.id} in Guild {member.guild.id}")
+        except discord.HTTPException as e:
+            self.logger.error(f"Discord error while updating LiveRole roles for Member {member.id}. Error: {e}")
 
-        if action is True:
-            await self.edit_member_roles.add_role(member=after, role=guild_liverole)
-        elif action is False:
-            await self.edit_member_roles.remove_role(member=after, role=guild_liverole)
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        """
+        Drops the cached LiveRole role of the guild when it is updated, so it is resolved again on next use.
+        """
+        self._invalidate_role_cache(role=before)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        """
+        Drops the cached LiveRole role of the guild when it is deleted.
+        """
+        self._invalidate_role_cache(role=role)
@@ -1,9 +1,16 @@
-from typing import Dict, Set
+from typing import FrozenSet, Mapping
 
 import discord
 
 
 class Modification(object):
-    def __init__(self, member: discord.Member, actions: Dict[bool, Set]):
+    """
+    Coalesced role modification for a member. Actions map True/False (Add/Remove) to the IDs of the roles,
+    so that no Role objects are retained while the modification is queued.
+    """
+
+    __slots__ = ("member", "actions")
+
+    def __init__(self, member: discord.Member, actions: Mapping[bool, FrozenSet[int]]):
         self.member = member
         self.actions = actions
@@ -2,6 +2,14 @@ import discord
 
 from cog_shared.seplib.utils import Result
 
+# the permission checks are pure, so each outcome is a single module-level Result
+_CAN_MSG_CHANNEL = Result(success=True, value=True, error=None)
+_CANNOT_MSG_CHANNEL = Result(
+    success=False, value=False, error="The bot does not have permissions to talk in that channel."
+)
+_CAN_MENTION_ROLE = Result(success=True, value=True, error=None)
+_CANNOT_MENTION_ROLE = Result(success=False, value=False, error="That role is not able to be mentioned.")
+
 
 def check_remind_role_permissions(role: discord.Role, channel: discord.TextChannel) -> Result[bool]:
     msg_result = bot_can_msg_channel(channel=channel)
@@ -12,12 +20,8 @@ def check_remind_role_permissions(role: discord.Role, channel: discord.TextChann
 
 
 def bot_can_msg_channel(channel: discord.TextChannel) -> Result[bool]:
-    if channel.permissions_for(channel.guild.me).send_messages:
-        return Result(success=True, value=True, error=None)
-    return Result(success=False, value=False, error="The bot does not have permissions to talk in that channel.")
+    return _CAN_MSG_CHANNEL if channel.permissions_for(channel.guild.me).send_messages else _CANNOT_MSG_CHANNEL
 
 
 def bot_can_mention_role(role: discord.Role) -> Result[bool]:
-    if role.mentionable:
-        return Result(success=True, error=None, value=True)
-    return Result(success=False, value=False, error="That role is not able to be mentioned.")
+    return _CAN_MENTION_ROLE if role.mentionable else _CANNOT_MENTION_ROLE
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+import time
 from typing import Optional, Dict
 
 from .google_photos import BaseGoogleAPI, GoogleTokenAPI
@@ -7,34 +7,53 @@ from .google_photos import GooglePhotosAPI
 
 
 class GooglePhotos(object):
-    def __init__(self, access_token: str, refresh_token: str, expires: datetime):
+
+    # refresh the access token this many seconds before it actually expires
+    REFRESH_MARGIN = 300.0
+
+    def __init__(self, access_token: str, refresh_token: str, expires_epoch: int):
         self.__access_token = access_token
         self.__refresh_token = refresh_token
-        self.__expires = expires
+        # the rate limit is per Google account, so it outlives any single API instance
+        self.__limiter = GooglePhotosAPI.build_limiter()
+        self.__expires_monotonic = time.monotonic() + (expires_epoch - time.time())
 
     @property
     def api(self) -> GooglePhotosAPI:
         try:
             return self.__api
         except AttributeError:
-            self.__api = GooglePhotosAPI(access_token=self.__access_token)
+            self.__api = GooglePhotosAPI(access_token=self.__access_token, limiter=self.__limiter)
         return self.__api
 
+    @property
+    def needs_refresh(self) -> bool:
+        return time.monotonic() + self.REFRESH_MARGIN >= self.__expires_monotonic
+
     async def refresh_access_token(self, client_id: str, client_secret: str) -> Optional[Dict]:
-        if datetime.utcnow() + timedelta(seconds=60) >= self.__expires:
+        if self.needs_refresh:
             result = await GoogleTokenAPI.get_refresh_token(
                 client_id=client_id, client_secret=client_secret, refresh_token=self.__refresh_token
             )
             if result.success:
                 data = result.value
                 self.__access_token = data.get("access_token")
-                self.__expires = datetime.utcnow() + timedelta(seconds=data.get("expires_in"))
-                self.clear_cache()
+                self.__expires_monotonic = time.monotonic() + data.get("expires_in")
+                self._update_api_token()
                 return data
         return
 
-    def clear_cache(self):
+    def _update_api_token(self):
+        try:
+            api = self.__api
+        except AttributeError:
+            return
+        api.set_access_token(access_token=self.__access_token)
+
+    async def close(self):
         try:
-            del self.__api
+            api = self.__api
         except AttributeError:
-            pass
+            return
+        del self.__api
+        await api.close()
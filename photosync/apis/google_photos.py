@@ -1,45 +1,126 @@
+import asyncio
+import functools
 import json
+import random
+import time
 
 import aiohttp
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
-from urllib.parse import urlencode
+from typing import AsyncIterable, Optional, Dict, List, Tuple, Union
+from urllib.parse import quote_plus, urlencode
 
 from cog_shared.seplib.utils import Result
 from photosync.apis.method import Method
+from photosync.apis.rate_limiter import TokenBucket
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(payload: Dict) -> bytes:
+    """
+    Serializes a JSON request payload straight to bytes, using orjson when it is installed.
+    :param payload: JSON-serializable payload.
+    :return: UTF-8 encoded JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def json_loads(raw: bytes) -> Dict:
+    """
+    Deserializes a raw JSON response body, using orjson when it is installed.
+    :param raw: Raw response body.
+    :return: Deserialized JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
 
 
 class BaseGoogleAPI(object):
 
     UPLOAD_URL = ""
 
+    JSON_CONTENT_TYPE = "application/json"
+
+    CONNECTION_LIMIT = 32
+    KEEPALIVE_TIMEOUT = 75
+    DNS_CACHE_TTL = 300
+
     def __init__(self, access_token):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.set_access_token(access_token=access_token)
+
+    def set_access_token(self, access_token: str) -> None:
+        """
+        Swaps the access token sent with every request. Auth only travels in the request headers, so the HTTP session
+        and its pooled connections are kept.
+        :param access_token: New access token.
+        :return: None
+        """
         self._access_token = access_token
+        self._auth_headers = {"Authorization": f"Bearer {access_token}"}
+        self._json_headers = {**self._auth_headers, "Content-Type": self.JSON_CONTENT_TYPE}
+
+    @classmethod
+    def _build_session(cls) -> aiohttp.ClientSession:
+        """
+        Builds a new pooled HTTP session, caching sockets and DNS lookups to the Google APIs between calls.
+        :return: New aiohttp ClientSession
+        """
+        connector = aiohttp.TCPConnector(
+            limit=cls.CONNECTION_LIMIT, keepalive_timeout=cls.KEEPALIVE_TIMEOUT, ttl_dns_cache=cls.DNS_CACHE_TTL
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Lazily constructed HTTP session which is reused for every request made by this API instance.
+        :return: aiohttp ClientSession
+        """
+        if self._session is None or self._session.closed:
+            self._session = self._build_session()
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Closes the HTTP session of this API instance, if one has been opened.
+        :return: None
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def _build_api_url(self, append_path: str = None):
         append_path = "" if append_path is None else append_path
         return f"{self.UPLOAD_URL}{append_path}"
 
     async def _raw_request(
-        self, method: Method, params: Optional[Dict] = None, data: Optional[Dict] = None, append_path: str = None
+        self,
+        method: Method,
+        params: Optional[Dict] = None,
+        data: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        append_path: str = None,
     ) -> Result[Dict]:
         pass
 
     async def _request(
         self, method: Method, params: Optional[Dict] = None, data: Optional[Dict] = None, append_path: str = None
     ) -> Result[Dict]:
-        params = {} if params is None else params
-        params["access_token"] = self._access_token
-
-        data = {} if data is None else data
-        data["access_token"] = self._access_token
-        return await self._raw_request(method=method, params=params, data=data, append_path=append_path)
+        return await self._raw_request(
+            method=method, params=params, data=data, headers=self._auth_headers, append_path=append_path
+        )
 
     async def _post(self, data: Dict = None, append_path: str = None) -> Result[Dict]:
         return await self._request(method=Method.POST, data=data, append_path=append_path)
 
     async def _get(self, params: Dict = None, append_path: str = None) -> Result[Dict]:
-        return await self._request(method=Method.POST, params=params, append_path=append_path)
+        return await self._request(method=Method.GET, params=params, append_path=append_path)
 
 
 class GoogleAuthorizeAPI(BaseGoogleAPI):
@@ -52,7 +133,12 @@ class GoogleAuthorizeAPI(BaseGoogleAPI):
         "https://www.googleapis.com/auth/photoslibrary.sharing"
     )
 
+    _STATIC_QUERY_STRING = urlencode(
+        {"scope": PHOTOS_SCOPES, "response_type": "code", "access_type": "offline", "include_granted_scopes": "true"}
+    )
+
     @staticmethod
+    @functools.lru_cache(maxsize=32)
     def build_auth_url(client_id: str, redirect_uri: str) -> str:
         """
         Builds the Google Photos app authorization URL that the user will need to go to to authorize the app.
@@ -60,27 +146,42 @@ class GoogleAuthorizeAPI(BaseGoogleAPI):
         :param redirect_uri: Redirect URI of the Google Photos App
         :return: Built Google Photos authorization URL that the user will need to go to to authorize the app.
         """
-        url = f"{GoogleAuthorizeAPI.API_URL}"
-        params = {
-            "client_id": client_id,
-            "redirect_uri": redirect_uri,
-            "scope": GoogleAuthorizeAPI.PHOTOS_SCOPES,
-            "response_type": "code",
-            "access_type": "offline",
-            "include_granted_scopes": "true",
-        }
-        query_string = urlencode(params)
-        return f"{url}?{query_string}"
+        return (
+            f"{GoogleAuthorizeAPI.API_URL}?client_id={quote_plus(client_id)}&redirect_uri={quote_plus(redirect_uri)}"
+            f"&{GoogleAuthorizeAPI._STATIC_QUERY_STRING}"
+        )
 
 
 class GoogleTokenAPI(BaseGoogleAPI):
 
     API_URL = "https://www.googleapis.com/oauth2/v4/token"
 
+    _token_session: Optional[aiohttp.ClientSession] = None
+
     @staticmethod
     def build_token_url():
         return f"{GoogleTokenAPI.API_URL}"
 
+    @classmethod
+    def get_token_session(cls) -> aiohttp.ClientSession:
+        """
+        The token endpoints are called without an API instance, so they share a single class-level HTTP session.
+        :return: aiohttp ClientSession
+        """
+        if cls._token_session is None or cls._token_session.closed:
+            cls._token_session = cls._build_session()
+        return cls._token_session
+
+    @classmethod
+    async def close_token_session(cls) -> None:
+        """
+        Closes the shared HTTP session used by the token endpoints, if one has been opened.
+        :return: None
+        """
+        if cls._token_session is not None and not cls._token_session.closed:
+            await cls._token_session.close()
+        cls._token_session = None
+
     @staticmethod
     async def get_access_token(
         client_id: str, client_secret: str, redirect_uri: str, auth_code: str
@@ -92,16 +193,13 @@ class GoogleTokenAPI(BaseGoogleAPI):
             "grant_type": "authorization_code",
             "redirect_uri": redirect_uri,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=GoogleTokenAPI.build_token_url(), data=auth_data) as resp:
-                if resp.status != 200:
-                    return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
-                data = await resp.json()
-                expires_time = datetime.strptime(resp.headers.get("Date"), "%a, %d %b %Y %H:%M:%S GMT") + timedelta(
-                    seconds=data.get("expires_in")
-                )
-                data["expires"] = expires_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-                return Result(success=True, value=data, error=None)
+        session = GoogleTokenAPI.get_token_session()
+        async with session.post(url=GoogleTokenAPI.build_token_url(), data=auth_data) as resp:
+            if resp.status != 200:
+                return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
+            data = json_loads(await resp.read())
+            data["expires_epoch"] = int(time.time()) + data.get("expires_in")
+            return Result(success=True, value=data, error=None)
 
     @staticmethod
     async def get_refresh_token(
@@ -113,11 +211,11 @@ class GoogleTokenAPI(BaseGoogleAPI):
             "refresh_token": refresh_token,
             "grant_type": "refresh_token",
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=GoogleTokenAPI.build_token_url(), data=auth_data) as resp:
-                if resp.status != 200:
-                    return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
-                return Result(success=True, value=await resp.json(), error=None)
+        session = GoogleTokenAPI.get_token_session()
+        async with session.post(url=GoogleTokenAPI.build_token_url(), data=auth_data) as resp:
+            if resp.status != 200:
+                return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
+            return Result(success=True, value=json_loads(await resp.read()), error=None)
 
 
 class GooglePhotosAPI(BaseGoogleAPI):
@@ -130,56 +228,152 @@ class GooglePhotosAPI(BaseGoogleAPI):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:62.0) Gecko/20100101 Firefox/62.0"
     }
 
-    def __init__(self, access_token: str):
+    BATCH_CREATE_MAX_ITEMS = 50
+
+    ALBUMS_CACHE_TTL = 60.0
+
+    # client-side limit on uploads/batchCreates, plus the backoff used when Google answers 429 regardless
+    RATE_LIMIT = 10
+    RATE_LIMIT_PERIOD = 1.0
+    MAX_RETRIES = 5
+    BACKOFF_BASE = 1.0
+    BACKOFF_CAP = 32.0
+    # streamed uploads up to this size are buffered, so they can be sent again after a 429
+    RETRY_BUFFER_MAX = 4 * 1024 * 1024
+
+    def __init__(self, access_token: str, limiter: Optional[TokenBucket] = None):
         super(GooglePhotosAPI, self).__init__(access_token=access_token)
+        self._albums_cache: Optional[Tuple[float, List[Dict]]] = None
+        self._limiter = limiter or self.build_limiter()
+
+    @classmethod
+    def build_limiter(cls) -> TokenBucket:
+        """
+        Builds the client-side rate limiter for one Google account. Share it across API instances of the same account.
+        :return: New TokenBucket
+        """
+        return TokenBucket(max_rate=cls.RATE_LIMIT, time_period=cls.RATE_LIMIT_PERIOD)
+
+    def set_access_token(self, access_token: str) -> None:
+        super(GooglePhotosAPI, self).set_access_token(access_token=access_token)
+        self._upload_headers = {
+            **self._auth_headers,
+            "Content-Type": "application/octet-stream",
+            "X-Goog-Upload-Protocol": "raw",
+        }
+
+    def invalidate_albums(self) -> None:
+        """
+        Clears the cached album list, forcing the next get_album_list call to fetch it from Google.
+        :return: None
+        """
+        self._albums_cache = None
 
     async def get_album_list(self) -> Result[Optional[List[Dict]]]:
-        params = {"access_token": self._access_token}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=self.ALBUMS_URL, params=params) as resp:
-                if resp.status != 200:
-                    return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
-                data = await resp.json()
-                return Result(success=True, value=data.get("albums"), error=None)
+        if self._albums_cache is not None:
+            cached_at, albums = self._albums_cache
+            if time.monotonic() - cached_at < self.ALBUMS_CACHE_TTL:
+                return Result(success=True, value=albums, error=None)
+
+        async with self.session.get(url=self.ALBUMS_URL, headers=self._auth_headers) as resp:
+            if resp.status != 200:
+                return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
+            data = json_loads(await resp.read())
+            albums = data.get("albums")
+            self._albums_cache = (time.monotonic(), albums)
+            return Result(success=True, value=albums, error=None)
 
     async def create_album(self, album: Dict):
         payload = {"album": album}
-        headers = {"Authorization": f"Bearer {self._access_token}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=self.ALBUMS_URL, json=payload, headers=headers) as resp:
-                if resp.status not in [200, 201]:
-                    return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
-                return Result(success=True, value=await resp.json(), error=None)
+        async with self.session.post(url=self.ALBUMS_URL, data=json_dumps(payload), headers=self._json_headers) as resp:
+            if resp.status not in [200, 201]:
+                return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
+            self.invalidate_albums()
+            return Result(success=True, value=json_loads(await resp.read()), error=None)
 
     async def share_album(self, album_id: str, share_options: Dict):
         share_url = f"{self.ALBUMS_URL}/{album_id}:share"
-        headers = {"Authorization": f"Bearer {self._access_token}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=share_url, json=share_options, headers=headers) as resp:
-                if resp.status not in [200, 201]:
-                    return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
-                return Result(success=True, value=await resp.json(), error=None)
-
-    async def upload_image(self, image_bytes: bytes) -> Result[Optional[str]]:
-        headers = {
-            "Authorization": f"Bearer {self._access_token}",
-            "Content-Type": "application/octet-stream",
-            "X-Goog-Upload-Protocol": "raw",
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=self.UPLOAD_URL, headers=headers, data=image_bytes) as resp:
-                if resp.status not in [200, 201]:
-                    return Result(success=False, error=await resp.text(), value=None)
-                return Result(success=True, value=await resp.text(), error=None)
+        async with self.session.post(url=share_url, data=json_dumps(share_options), headers=self._json_headers) as resp:
+            if resp.status not in [200, 201]:
+                return Result(success=False, value=None, error=f"Error from Google API: {resp.content}")
+            self.invalidate_albums()
+            return Result(success=True, value=json_loads(await resp.read()), error=None)
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """
+        Delay before retrying a rate limited request: capped exponential backoff with full jitter, but never shorter
+        than the Retry-After hinted by Google.
+        :param attempt: Number of retries made so far.
+        :param retry_after: Value of the Retry-After header of the rejected response, if any.
+        :return: Delay in seconds.
+        """
+        delay = random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt))
+        try:
+            return max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            return delay
 
-    async def batch_create(self, album_id: str, upload_token: str, file_name: str) -> Result[Optional[str]]:
+    async def _rate_limited_post(self, url: str, headers: Dict, data, retry: bool = True) -> Tuple[int, bytes]:
+        """
+        Sends a POST request through the rate limiter, retrying with backoff while Google responds with 429.
+        :param url: URL to post to.
+        :param headers: Request headers.
+        :param data: Request body.
+        :param retry: Whether the request can be retried. Streamed bodies are consumed by the first attempt.
+        :return: Tuple of the final response status and body.
+        """
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            async with self.session.post(url=url, headers=headers, data=data) as resp:
+                status, body = resp.status, await resp.read()
+                retry_after = resp.headers.get("Retry-After")
+            if status != 429 or not retry or attempt >= self.MAX_RETRIES:
+                return status, body
+            await asyncio.sleep(self._backoff_delay(attempt=attempt, retry_after=retry_after))
+            attempt += 1
+
+    async def upload_image(
+        self, image: Union[bytes, AsyncIterable[bytes], aiohttp.StreamReader], content_length: Optional[int] = None
+    ) -> Result[Optional[str]]:
+        """
+        Uploads the raw bytes of an image to Google Photos.
+        Streams of up to RETRY_BUFFER_MAX bytes are read into memory first, so they are retried on 429 like bytes are.
+        Larger or unsized streams are sent without buffering and are not retried, as the first attempt consumes them.
+        :param image: Image bytes, or an async iterable/stream of them.
+        :param content_length: Size of the image, if known. Streamed images are sent chunked when not specified.
+        :return: Result with the upload token of the image.
+        """
+        retry = isinstance(image, bytes)
+        if isinstance(image, aiohttp.StreamReader) and content_length is not None:
+            retry = content_length <= self.RETRY_BUFFER_MAX
+            if retry:
+                image = await image.read()
+        headers = self._upload_headers
+        if content_length is not None:
+            headers = {**headers, "Content-Length": str(content_length)}
+        status, body = await self._rate_limited_post(url=self.UPLOAD_URL, headers=headers, data=image, retry=retry)
+        if status not in [200, 201]:
+            return Result(success=False, error=f"Error from Google API (HTTP {status}): {body.decode()}", value=None)
+        return Result(success=True, value=body.decode(), error=None)
+
+    async def batch_create(self, album_id: str, items: List[Tuple[str, str]]) -> Result[Optional[Dict]]:
+        """
+        Creates media items in an album from previously uploaded images, in a single request.
+        :param album_id: ID of the album the media items will be added to.
+        :param items: List of (upload token, file name) pairs. At most BATCH_CREATE_MAX_ITEMS per request.
+        :return: Result with the batchCreate response from Google.
+        """
         payload = {
             "albumId": album_id,
-            "newMediaItems": [{"description": file_name, "simpleMediaItem": {"uploadToken": upload_token}}],
+            "newMediaItems": [
+                {"description": file_name, "simpleMediaItem": {"uploadToken": upload_token}}
+                for upload_token, file_name in items
+            ],
         }
-        headers = {"Authorization": f"Bearer {self._access_token}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=self.BATCH_CREATE_URL, headers=headers, json=payload) as resp:
-                if resp.status not in [200, 201]:
-                    return Result(success=False, error=await resp.text(), value=None)
-                return Result(success=True, value=await resp.text())
+        status, body = await self._rate_limited_post(
+            url=self.BATCH_CREATE_URL, headers=self._json_headers, data=json_dumps(payload)
+        )
+        if status not in [200, 201]:
+            return Result(success=False, error=f"Error from Google API (HTTP {status}): {body.decode()}", value=None)
+        return Result(success=True, value=json_loads(body), error=None)
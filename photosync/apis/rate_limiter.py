@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+
+class TokenBucket(object):
+    def __init__(self, max_rate: float, time_period: float = 1.0):
+        """
+        Client-side token bucket rate limiter. Allows bursts of up to max_rate calls, refilling at a steady rate of
+        max_rate calls per time_period seconds.
+        :param max_rate: Maximum number of calls allowed per time period.
+        :param time_period: Length of the time period, in seconds.
+        """
+        self.max_rate = max_rate
+        self._fill_rate = max_rate / time_period
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_rate, self._tokens + (now - self._updated) * self._fill_rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it. Waiters are served in the order they arrived.
+        :return: None
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._fill_rate)
+                self._refill()
+            self._tokens -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
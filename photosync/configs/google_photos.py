@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional, Dict, Union
 
 import discord
@@ -56,33 +57,37 @@ class GooglePhotosConfig(object):
         return confirm_response
 
     @staticmethod
-    async def __config_get_response(ctx: Context, timeout: int, title: str, message: str):
-        reply = PhotoSyncReply(message=message, title=title)
-        await reply.send(ctx)
-
+    async def __config_get_response(ctx: Context, timeout: int, reply: PhotoSyncReply):
         predicate_check = GetReplyPredicate.string_reply(ctx=ctx, user=ctx.author)
-        await ctx.bot.wait_for("message", check=predicate_check, timeout=timeout)
+        # start listening before the prompt is sent, so an instant reply can't be missed
+        response_waiter = asyncio.ensure_future(ctx.bot.wait_for("message", check=predicate_check, timeout=timeout))
+        try:
+            await reply.send(ctx)
+        except Exception:
+            response_waiter.cancel()
+            raise
+        await response_waiter
         response_text = predicate_check.result.clean_content
         await predicate_check.result.delete()
         return response_text
 
     @staticmethod
-    async def __config_client_id(ctx: Context, timeout: int) -> str:
+    def __client_id_reply() -> PhotoSyncReply:
         title = "Google Photos Configruation [Part 2 of 6] - Client ID"
         message = "Please tell me the **Client ID** of your Google Photos App"
-        return await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, message=message, title=title)
+        return PhotoSyncReply(message=message, title=title)
 
     @staticmethod
-    async def __config_client_secret(ctx: Context, timeout: int) -> str:
+    def __client_secret_reply() -> PhotoSyncReply:
         title = "Google Photos Configuration [Part 3 of 6] - Client Secret"
         message = "Please tell me the **Client Secret** of your Google Photos App"
-        return await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, message=message, title=title)
+        return PhotoSyncReply(message=message, title=title)
 
     @staticmethod
-    async def __config_redirect_uri(ctx: Context, timeout: int) -> str:
+    def __redirect_uri_reply() -> PhotoSyncReply:
         title = "Google Photos Configuration [Part 4 of 6] - Redirect URI"
         message = "Please tell me the **Redirect URI** of your Google Photos App"
-        return await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, message=message, title=title)
+        return PhotoSyncReply(message=message, title=title)
 
     @staticmethod
     async def __config_auth_code(ctx: Context, timeout: int = 60) -> str:
@@ -94,7 +99,8 @@ class GooglePhotosConfig(object):
             "**Address:** `https://localhost/gp_auth?code=HrHiYOCo8N3xgL9tkk&scopes=photoslibrary`\n"
             "**Your Code:** `HrHiYOCo8N3xgL9tkk`\n\n"
         )
-        return await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, message=message, title=title)
+        reply = PhotoSyncReply(message=message, title=title)
+        return await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, reply=reply)
 
     @staticmethod
     async def __config_give_auth_url(ctx: Context, auth_url: str):
@@ -115,6 +121,11 @@ class GooglePhotosConfig(object):
     async def start_config(ctx: Context, timeout: int = 60) -> Optional[Dict[str, str]]:
         auth_data = {}
 
+        # build all of the prompts before the user starts interacting
+        client_id_reply = GooglePhotosConfig.__client_id_reply()
+        client_secret_reply = GooglePhotosConfig.__client_secret_reply()
+        redirect_uri_reply = GooglePhotosConfig.__redirect_uri_reply()
+
         # CONFIG INTRO MESSAGE
         confirmed = await GooglePhotosConfig.__config_welcome(ctx=ctx, timeout=timeout)
         if not confirmed:
@@ -122,21 +133,25 @@ class GooglePhotosConfig(object):
             return
 
         # CLIENT ID
-        client_id = await GooglePhotosConfig.__config_client_id(ctx=ctx, timeout=timeout)
+        client_id = await GooglePhotosConfig.__config_get_response(ctx=ctx, timeout=timeout, reply=client_id_reply)
         if not client_id:
             await ContextWrapper(ctx).cross()
             return
         auth_data["client_id"] = client_id
 
         # CLIENT SECRET
-        client_secret = await GooglePhotosConfig.__config_client_secret(ctx=ctx, timeout=timeout)
+        client_secret = await GooglePhotosConfig.__config_get_response(
+            ctx=ctx, timeout=timeout, reply=client_secret_reply
+        )
         if not client_secret:
             await ContextWrapper(ctx).cross()
             return
         auth_data["client_secret"] = client_secret
 
         # REDIRECT URI
-        redirect_uri = await GooglePhotosConfig.__config_redirect_uri(ctx=ctx, timeout=timeout)
+        redirect_uri = await GooglePhotosConfig.__config_get_response(
+            ctx=ctx, timeout=timeout, reply=redirect_uri_reply
+        )
         if not redirect_uri:
             await ContextWrapper(ctx).cross()
             return
@@ -1,6 +1,10 @@
+import asyncio
+import calendar
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 
 import aiohttp
 import discord
@@ -8,7 +12,7 @@ import discord
 from cog_shared.seplib.cog import SepCog
 from cog_shared.seplib.replies import ErrorReply, SuccessReply
 from cog_shared.seplib.utils import Result
-from photosync.apis import GooglePhotos
+from photosync.apis import GooglePhotos, GooglePhotosAPI, GoogleTokenAPI
 from photosync.configs import GooglePhotosConfig
 from redbot.core import Config, checks
 from redbot.core.bot import Red
@@ -23,6 +27,11 @@ class PhotoSync(SepCog):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:62.0) Gecko/20100101 Firefox/62.0"
     }
 
+    UPLOAD_CONCURRENCY = 8
+
+    # seconds to wait after a config change before writing the dirty guilds to disk, coalescing bursts of changes
+    CONFIG_FLUSH_DELAY = 2
+
     SCOPES = [
         "https://www.googleapis.com/auth/photoslibrary",
         "https://www.googleapis.com/auth/photoslibrary.readonly.appcreateddata",
@@ -34,8 +43,17 @@ class PhotoSync(SepCog):
 
         self.guild_google_auth_config: Dict[int, Dict[str, str]] = {}
         self.guild_google_maps_config: Dict[int, Dict[str, str]] = {}
+        self._channel_to_album: Dict[Tuple[int, int], str] = {}
         self._guild_google_apis: Dict[int, GooglePhotos] = {}
-
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._upload_semaphore = asyncio.Semaphore(self.UPLOAD_CONCURRENCY)
+        self._album_id_cache: Dict[Tuple[int, str], str] = {}
+        self._album_id_inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._auth_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._dirty_guilds: Set[int] = set()
+        self._config_dirty = asyncio.Event()
+
+        self._add_future(self.__flush_config())
         self._ensure_futures()
 
     async def _init_cache(self):
@@ -57,52 +75,121 @@ class PhotoSync(SepCog):
 
         self.guild_google_auth_config = guild_google_auth
         self.guild_google_maps_config = guild_google_maps
+        # flattened view of the channel mappings, looked up for every message the bot sees
+        self._channel_to_album = {
+            (guild_id, int(channel_id)): album_name
+            for guild_id, google_maps in guild_google_maps.items()
+            for channel_id, album_name in google_maps.items()
+        }
+
+    def cog_unload(self):
+        super(PhotoSync, self).cog_unload()
+        for guild_api in self._guild_google_apis.values():
+            self.bot.loop.create_task(guild_api.close())
+        self._guild_google_apis = {}
+        self.bot.loop.create_task(GoogleTokenAPI.close_token_session())
+        if self._http is not None:
+            self.bot.loop.create_task(self._http.close())
+            self._http = None
+        self.bot.loop.create_task(self._flush_dirty_guilds())
+        self._config_dirty.set()
 
     def _register_config_entities(self, config: Config):
         config.register_guild(google_auth={})
         config.register_guild(google_maps={})
 
+    def _mark_guild_dirty(self, guild_id: int) -> None:
+        """
+        Flags the guild's in-memory configuration as changed, so it is written to the database on the next flush.
+        :param guild_id: ID of the Discord Guild.
+        :return: None
+        """
+        self._dirty_guilds.add(guild_id)
+        self._config_dirty.set()
+
+    async def _flush_dirty_guilds(self) -> None:
+        """
+        Writes the Google auth and channel mappings of every guild flagged as changed to the database.
+        :return: None
+        """
+        dirty_guilds, self._dirty_guilds = self._dirty_guilds, set()
+        for guild_id in dirty_guilds:
+            guild_config = self.config.guild(guild=discord.Object(id=guild_id))
+            await guild_config.google_auth.set(self.guild_google_auth_config.get(guild_id, {}))
+            await guild_config.google_maps.set(self.guild_google_maps_config.get(guild_id, {}))
+
+    async def __flush_config(self):
+        """
+        Async future which loops while the cog is loaded, persisting configuration changes shortly after they are
+        made, so token refreshes and new mappings don't wait on disk writes.
+        :return: None
+        """
+        await self.bot.wait_until_ready()
+
+        while self == self.bot.get_cog(self.__class__.__name__):
+            await self._config_dirty.wait()
+            await asyncio.sleep(self.CONFIG_FLUSH_DELAY)
+            self._config_dirty.clear()
+            await self._flush_dirty_guilds()
+
     async def _get_google_api(self, guild: discord.Guild) -> Optional[GooglePhotos]:
 
-        current_api = self._guild_google_apis.get(guild.id)
+        guild_google_auth = self._get_guild_auth(guild=guild, service="google")
+        if not guild_google_auth:
+            return
 
+        current_api = self._guild_google_apis.get(guild.id)
         if not current_api:
-
-            guild_google_auth = self._get_guild_auth(guild=guild, service="google")
-            if not guild_google_auth:
-                return
-            expires_str = guild_google_auth.get("expires")
-            expires_dt = datetime.strptime(expires_str, "%Y-%m-%dT%H:%M:%SZ")
+            expires_epoch = guild_google_auth.get("expires_epoch")
+            rewrite_auth = expires_epoch is None
+            if rewrite_auth:
+                # auth saved before expires_epoch existed only has the formatted "expires" string
+                expires_dt = datetime.strptime(guild_google_auth.pop("expires"), "%Y-%m-%dT%H:%M:%SZ")
+                expires_epoch = calendar.timegm(expires_dt.utctimetuple())
+                guild_google_auth["expires_epoch"] = expires_epoch
             current_api = GooglePhotos(
                 access_token=guild_google_auth.get("access_token"),
                 refresh_token=guild_google_auth.get("refresh_token"),
-                expires=expires_dt,
+                expires_epoch=expires_epoch,
             )
+            self._guild_google_apis[guild.id] = current_api
+            if rewrite_auth:
+                self._update_guild_auth(guild=guild, service="google", auth=guild_google_auth)
+
+        if not current_api.needs_refresh:
+            return current_api
+
+        async with self._auth_locks[guild.id]:
+            # another lookup may have refreshed the token while this one was waiting for the lock
+            if not current_api.needs_refresh:
+                return current_api
+
             refresh_data = await current_api.refresh_access_token(
                 client_id=guild_google_auth.get("client_id"), client_secret=guild_google_auth.get("client_secret")
             )
             if refresh_data:
-                new_expires = datetime.utcnow() + timedelta(seconds=refresh_data.get("expires_in"))
-                refresh_data["expires"] = new_expires.strftime("%Y-%m-%dT%H:%M:%SZ")
+                refresh_data["expires_epoch"] = int(time.time()) + refresh_data.get("expires_in")
                 guild_google_auth.update(refresh_data)
-                await self._update_guild_auth(guild=guild, service="google", auth=guild_google_auth)
+                self._update_guild_auth(guild=guild, service="google", auth=guild_google_auth)
         return current_api
 
-    async def _add_google_mapping(self, guild: discord.Guild, channel: discord.TextChannel, album_name: str):
+    def _add_google_mapping(self, guild: discord.Guild, channel: discord.TextChannel, album_name: str):
         current_map = self.guild_google_maps_config.get(guild.id, {})
         current_map[str(channel.id)] = album_name
         self.guild_google_maps_config[guild.id] = current_map
-        await self.config.guild(guild=guild).google_maps.set(current_map)
+        self._channel_to_album[(guild.id, channel.id)] = album_name
+        self._clear_album_id_cache(guild=guild)
+        self._mark_guild_dirty(guild_id=guild.id)
         self.logger.info(f"Added Google Photos mapping: Channel: {channel.name}|{channel.id} | Album: {album_name}")
 
     def _get_google_album_name(self, channel: discord.TextChannel) -> Optional[str]:
-        return self.guild_google_maps_config.get(channel.guild.id, {}).get(str(channel.id))
+        return self._channel_to_album.get((channel.guild.id, channel.id))
 
-    async def _update_guild_auth(self, guild: discord.Guild, service: str, auth: Dict):
+    def _update_guild_auth(self, guild: discord.Guild, service: str, auth: Dict):
 
         if service == "google":
             self.guild_google_auth_config[guild.id] = auth
-            await self.config.guild(guild=guild).google_auth.set(auth)
+            self._mark_guild_dirty(guild_id=guild.id)
             self.logger.info(f"Updated Google Auth config for Guild: {guild.name}|{guild.id}.")
         else:
             self.logger.error(f"Unknown service {service}")
@@ -113,7 +200,53 @@ class PhotoSync(SepCog):
             return self.guild_google_auth_config.get(guild.id)
         self.logger.error(f"Unknown service {service}")
 
+    def _drop_google_api(self, guild: discord.Guild) -> None:
+        """
+        Forgets the cached Google Photos API of the guild and closes it, so the next lookup is built from the stored
+        auth. Used when the guild re-authorizes, as the cached API still holds the old tokens.
+        :param guild: Discord Guild
+        :return: None
+        """
+        guild_api = self._guild_google_apis.pop(guild.id, None)
+        if guild_api is not None:
+            self.bot.loop.create_task(guild_api.close())
+
+    def _clear_album_id_cache(self, guild: discord.Guild) -> None:
+        """
+        Forgets the resolved Google Photos album IDs of the guild, so they are looked up again on next use.
+        :param guild: Discord Guild
+        :return: None
+        """
+        for key in [key for key in self._album_id_cache if key[0] == guild.id]:
+            del self._album_id_cache[key]
+
     async def _get_google_album_id(self, guild: discord.Guild, album_name: str) -> Result[Optional[str]]:
+        # album IDs are stable, so once resolved they are served from memory
+        cache_key = (guild.id, album_name.lower())
+        cached_id = self._album_id_cache.get(cache_key)
+        if cached_id is not None:
+            return Result(success=True, value=cached_id, error=None)
+
+        # concurrent lookups of the same album share a single in-flight resolution
+        inflight = self._album_id_inflight.get(cache_key)
+        if inflight is None:
+            inflight = self.bot.loop.create_task(
+                self._resolve_google_album_id(guild=guild, album_name=album_name, cache_key=cache_key)
+            )
+            self._album_id_inflight[cache_key] = inflight
+            inflight.add_done_callback(lambda _: self._album_id_inflight.pop(cache_key, None))
+        return await asyncio.shield(inflight)
+
+    async def _resolve_google_album_id(
+        self, guild: discord.Guild, album_name: str, cache_key: Tuple[int, str]
+    ) -> Result[Optional[str]]:
+        """
+        Looks up the ID of the album by name, creating the album if it does not exist yet, and caches it.
+        :param guild: Discord Guild
+        :param album_name: Name of the Google Photos album.
+        :param cache_key: Album ID cache key of the album.
+        :return: Result with the album ID.
+        """
         guild_api = await self._get_google_api(guild=guild)
         if not guild_api:
             return Result(success=False, error=f"Google Photos is not configure for Guild: {guild.id}", value=None)
@@ -121,9 +254,10 @@ class PhotoSync(SepCog):
         if not result.success:
             return result
 
-        albums = result.value
+        albums = result.value or []
         for album in albums:
-            if album_name.lower() == album.get("title", "").lower():
+            if cache_key[1] == album.get("title", "").lower():
+                self._album_id_cache[cache_key] = album.get("id")
                 return Result(success=True, value=album.get("id"), error=None)
 
         # album does not exist, create it
@@ -132,34 +266,65 @@ class PhotoSync(SepCog):
         if not create_result.success:
             return create_result
         album_id = create_result.value.get("id")
+        self._album_id_cache[cache_key] = album_id
 
         return Result(success=True, value=album_id, error=None)
 
     @staticmethod
-    def _get_photo_urls_from_message(message: discord.Message):
-        photo_urls = set()
-        for attachment in message.attachments:
-            if attachment.height is not None and attachment.width is not None:
-                photo_urls.add(attachment.url)
-        return photo_urls
-
-    async def _get_discord_image(self, url: str) -> Optional[bytes]:
-        async with aiohttp.ClientSession(headers=self.DISCORD_IMG_REQ_HEADERS) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    return await resp.read()
+    def _get_photo_urls_from_message(message: discord.Message) -> List[str]:
+        # only image attachments have dimensions; the list keeps the photos in the order they were attached
+        return [attachment.url for attachment in message.attachments if attachment.height is not None]
 
-    async def _upload_google_photo_and_get_token(self, guild: discord.Guild, photo_url: str) -> Result[Optional[str]]:
-        discord_img = await self._get_discord_image(url=photo_url)
-        if not discord_img:
-            return Result(success=False, error="Unable to get Discord image", value=None)
+    async def _session(self) -> aiohttp.ClientSession:
+        """
+        Lazily constructed HTTP session which is reused for every Discord image download.
+        :return: aiohttp ClientSession
+        """
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=75)
+            self._http = aiohttp.ClientSession(headers=self.DISCORD_IMG_REQ_HEADERS, connector=connector)
+        return self._http
 
+    async def _upload_google_photo_and_get_token(self, guild: discord.Guild, photo_url: str) -> Result[Optional[str]]:
         guild_api = await self._get_google_api(guild=guild)
         if not guild_api:
             return Result(success=False, error=f"Google API is not set up for guild {guild.id}", value=None)
 
-        upload_result = await guild_api.api.upload_image(image_bytes=discord_img)
-        return upload_result
+        # the download body is streamed straight into the upload, so the image is never held in memory as a whole
+        session = await self._session()
+        async with session.get(photo_url) as resp:
+            if resp.status != 200:
+                return Result(success=False, error="Unable to get Discord image", value=None)
+            return await guild_api.api.upload_image(image=resp.content, content_length=resp.content_length)
+
+    async def _process_url(self, guild: discord.Guild, url: str) -> Result[Optional[str]]:
+        """
+        Uploads a single Discord image to Google Photos, limited to UPLOAD_CONCURRENCY uploads at a time.
+        :param guild: Guild the image was posted in.
+        :param url: URL of the Discord image.
+        :return: Result with the upload token of the image.
+        """
+        async with self._upload_semaphore:
+            return await self._upload_google_photo_and_get_token(guild=guild, photo_url=url)
+
+    async def _add_photos_to_album(self, guild_api: GooglePhotos, album_id: str, items: List[Tuple[str, str]]) -> None:
+        """
+        Adds uploaded photos to the album, with as few batchCreate requests as possible.
+        :param guild_api: Google Photos API of the guild.
+        :param album_id: ID of the Google Photos album.
+        :param items: List of (upload token, file name) pairs of the uploaded photos.
+        :return: None
+        """
+        max_items = GooglePhotosAPI.BATCH_CREATE_MAX_ITEMS
+        for start in range(0, len(items), max_items):
+            batch_result = await guild_api.api.batch_create(album_id=album_id, items=items[start : start + max_items])
+            if not batch_result.success:
+                self.logger.error(batch_result.error)
+                continue
+            for item_result in batch_result.value.get("newMediaItemResults", []):
+                status = item_result.get("status", {})
+                if status.get("code"):
+                    self.logger.error(f"Unable to add photo to Google Photos album: {status.get('message')}")
 
     @staticmethod
     def _check_channel_permissions(channel: discord.TextChannel) -> Result:
@@ -214,7 +379,8 @@ class PhotoSync(SepCog):
         """
         updated_auth = await GooglePhotosConfig.start_config(ctx=ctx, timeout=timeout)
         if updated_auth:
-            await self._update_guild_auth(guild=ctx.guild, auth=updated_auth, service="google")
+            self._update_guild_auth(guild=ctx.guild, auth=updated_auth, service="google")
+            self._drop_google_api(guild=ctx.guild)
 
     @photosync.group(name="continue")
     @checks.admin_or_permissions()
@@ -238,7 +404,9 @@ class PhotoSync(SepCog):
             ctx=ctx, auth_data=self._get_guild_auth(service="google", guild=ctx.guild), timeout=timeout
         )
         if updated_auth:
-            await self._update_guild_auth(auth=updated_auth, guild=ctx.guild, service="google")
+            self._update_guild_auth(auth=updated_auth, guild=ctx.guild, service="google")
+            self._drop_google_api(guild=ctx.guild)
+            self._clear_album_id_cache(guild=ctx.guild)
             # TODO: self._refresh_google_api(guild_id=ctx.guild.id, guild_auth=updated_auth)
 
     @photosync.group(name="map")
@@ -260,7 +428,26 @@ class PhotoSync(SepCog):
         channel_checks = self._check_channel_permissions(channel=channel)
         if not channel_checks.success:
             return ErrorReply(message=channel_checks.error).send(ctx)
-        await self._add_google_mapping(guild=ctx.guild, channel=channel, album_name=album_name)
+        self._add_google_mapping(guild=ctx.guild, channel=channel, album_name=album_name)
+        return await ctx.tick()
+
+    @photosync.group(name="cache")
+    @checks.admin_or_permissions()
+    async def photosync_cache(self, ctx: Context):
+        """
+        Manage PhotoSync's in-memory caches.
+        """
+        pass
+
+    @photosync_cache.command(name="clear")
+    @checks.admin_or_permissions()
+    async def photosync_cache_clear(self, ctx: Context):
+        """
+        Clears the cached album IDs for this server, forcing them to be looked up again.
+
+        Use this if an album was renamed or deleted in Google Photos.
+        """
+        self._clear_album_id_cache(guild=ctx.guild)
         return await ctx.tick()
 
     @commands.Cog.listener()
@@ -269,13 +456,18 @@ class PhotoSync(SepCog):
         Discord event to upload Google Photos.
         """
 
-        if not isinstance(message.channel, discord.TextChannel):
+        if message.author.bot or not isinstance(message.channel, discord.TextChannel):
             return
 
         album_name = self._get_google_album_name(channel=message.channel)
         if album_name is None:
             return
 
+        # collecting the photos needs no I/O, so text-only messages never reach the Google APIs
+        photo_urls = self._get_photo_urls_from_message(message=message)
+        if not photo_urls:
+            return
+
         album_id = await self._get_google_album_id(guild=message.guild, album_name=album_name)
         if not album_id.success:
             return
@@ -284,23 +476,22 @@ class PhotoSync(SepCog):
         guild_api = await self._get_google_api(guild=message.guild)
         if not guild_api:
             self.logger.warning(f"Google Photos API is not configured for guild: {message.guild.id}")
-
-        photo_urls = self._get_photo_urls_from_message(message=message)
-        if not photo_urls:
             return
 
-        for url in photo_urls:
-            upload_result = await self._upload_google_photo_and_get_token(guild=message.guild, photo_url=url)
-            if not upload_result.success:
+        upload_results = await asyncio.gather(
+            *[self._process_url(guild=message.guild, url=url) for url in photo_urls], return_exceptions=True
+        )
+        items = []
+        for url, upload_result in zip(photo_urls, upload_results):
+            if isinstance(upload_result, Exception):
+                self.logger.error(f"Error uploading photo to Google Photos: {upload_result}")
+            elif not upload_result.success:
                 self.logger.error(upload_result.error)
-                continue
-            token = upload_result.value
-            file_name = os.path.basename(url)
+            else:
+                items.append((upload_result.value, os.path.basename(url)))
 
-            batch_result = await guild_api.api.batch_create(album_id=album_id, upload_token=token, file_name=file_name)
-            if not batch_result.success:
-                self.logger.error(batch_result.error)
-                continue
+        if items:
+            await self._add_photos_to_album(guild_api=guild_api, album_id=album_id, items=items)
         await message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
 
     @photosync.command(name="album")
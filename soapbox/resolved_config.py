@@ -0,0 +1,32 @@
+from typing import Dict, Optional
+
+import discord
+
+
+class ResolvedConfig(object):
+    """
+    Soapbox configuration of a guild with the defaults already filled in, so that the voice state hot path
+    reads plain attributes. This is the only in-memory copy of the config; it is serialized back to a dict on write.
+    """
+
+    __slots__ = ("suffix", "max_channels", "trigger_channel_id", "category_id", "category")
+
+    def __init__(self, suffix: str, max_channels: int, trigger_channel_id: Optional[int], category_id: Optional[int]):
+        self.suffix = suffix
+        self.max_channels = max_channels
+        self.trigger_channel_id = trigger_channel_id
+        self.category_id = category_id
+        # resolved lazily from category_id and dropped when the channel is deleted; never persisted
+        self.category: Optional[discord.CategoryChannel] = None
+
+    def to_config(self) -> Dict:
+        """
+        Serializes the configuration into the dict which is stored in the guild's config.
+        :return: Guild config dict.
+        """
+        return {
+            "trigger_channel": self.trigger_channel_id,
+            "category": self.category_id,
+            "user_max_channels": self.max_channels,
+            "suffix": self.suffix,
+        }
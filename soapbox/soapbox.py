@@ -1,4 +1,6 @@
-from typing import Dict, List, Optional, Union
+import asyncio
+import functools
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union
 
 import discord
 
@@ -10,6 +12,7 @@ from redbot.core.bot import Red
 from redbot.core.commands import Context
 from soapbox.permissions_checks import bot_can_manage_category, bot_can_move_members, check_configure_permissions
 from soapbox.replies import SoapboxEmbedReply, SoapboxErrorReply, SoapboxSuccessReply
+from soapbox.resolved_config import ResolvedConfig
 
 
 class Soapbox(SepCog):
@@ -28,45 +31,165 @@ class Soapbox(SepCog):
     DEFAULT_MAX_USER_SOAPBOXES = 2
     HARD_MAX_USER_SOAPBOXES_CAP = 100
 
+    # seconds to wait after a config change before writing it, so successive set commands share a single write
+    CONFIG_FLUSH_DELAY = 0.25
+
+    _NO_CHANNELS: FrozenSet[int] = frozenset()
+
     def __init__(self, bot: Red):
         super(Soapbox, self).__init__(bot=bot)
 
-        self.guild_config_cache: Dict[int, Dict] = {}
+        self._resolved: Dict[int, ResolvedConfig] = {}
+        self._loaded_guilds: Set[int] = set()
+        self._managed_channels: Dict[int, Set[int]] = {}
+        self._creating: Set[Tuple[int, int]] = set()
+        self._default_resolved = self._resolve_config(config={})
+        self._dirty_guilds: Dict[int, Set[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
 
         self._ensure_futures()
 
+    def cog_unload(self):
+        super(Soapbox, self).cog_unload()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._dirty_guilds:
+            self.bot.loop.create_task(self._flush_dirty_guilds())
+
     async def _init_cache(self):
         """
-        Loads Soapbox's guild configuration into a local cache/memory.
+        Soapbox's guild configuration is loaded lazily, the first time each guild needs it, rather than reading every
+        guild's config at startup. See _ensure_loaded.
         :return: None
         """
         await self.bot.wait_until_ready()
 
-        guilds_config: Dict[int, Dict[str, Dict]] = await self.config.all_guilds()
-        guild_cache: Dict[int, Dict] = {}
-
-        for guild_id, guild_data in guilds_config.items():
-            config = guild_data.get("config")
-            if config:
-                guild_cache[guild_id] = config
-
-        self.guild_config_cache = guild_cache
+    async def _ensure_loaded(self, guild: discord.Guild) -> None:
+        """
+        Loads the guild's Soapbox configuration into the local cache/memory, if it hasn't been loaded yet, and scans
+        its Soapbox category for existing Soapbox channels. Guilds without a config are remembered as loaded, so
+        the database is only read once per guild.
+        :param guild: Guild for which to load the configuration.
+        :return: None
+        """
+        if guild.id in self._loaded_guilds:
+            return
+        config = await self.config.guild(guild).config()
+        if guild.id in self._loaded_guilds:
+            return  # loaded by a concurrent call while this one was reading
+
+        self._loaded_guilds.add(guild.id)
+        if not config:
+            return
+        resolved = self._resolve_config(config=config)
+        self._resolved[guild.id] = resolved
+        # only guilds with a category can have Soapbox channels to scan for
+        if resolved.category_id is not None:
+            self._managed_channels[guild.id] = self._scan_managed_channels(guild=guild)
 
     def _register_config_entities(self, config: Config):
         # register configuration for guilds in Soapbox
         config.register_guild(config={})
 
+    def _mark_guild_dirty(self, guild: discord.Guild, keys: Iterable[str]) -> None:
+        """
+        Flags config keys of the guild as changed and schedules a flush of all changed guilds, if one isn't pending.
+        :param guild: Guild whose config changed.
+        :param keys: Config keys which changed.
+        :return: None
+        """
+        self._dirty_guilds.setdefault(guild.id, set()).update(keys)
+        if self._flush_task is None:
+            self._flush_task = self.bot.loop.create_task(self._flush_after(delay=self.CONFIG_FLUSH_DELAY))
+
+    async def _flush_after(self, delay: float) -> None:
+        """
+        Waits for the config changes to settle, then writes every changed guild's config to the database.
+        :param delay: Seconds to wait before writing.
+        :return: None
+        """
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self._flush_dirty_guilds()
+
+    async def _flush_dirty_guilds(self) -> None:
+        """
+        Writes the changed config keys of every guild flagged as changed to the database. Only the changed keys
+        are written, rather than the guild's whole config.
+        :return: None
+        """
+        dirty_guilds, self._dirty_guilds = self._dirty_guilds, {}
+        for guild_id, keys in dirty_guilds.items():
+            resolved = self._resolved.get(guild_id)
+            if resolved is None:
+                continue
+            guild_config = resolved.to_config()
+            guild_group = self.config.guild(discord.Object(id=guild_id))
+            for key in keys:
+                await guild_group.set_raw("config", key, value=guild_config[key])
+
+    def _run_in_background(self, coro, action: str) -> asyncio.Task:
+        """
+        Schedules a Discord API call whose result nothing waits on, so it stays off the critical path.
+        Failures are logged once the call completes.
+        :param coro: Coroutine of the API call.
+        :param action: Description of the call, used in the error log.
+        :return: Task running the call.
+        """
+        task = self.bot.loop.create_task(coro)
+        task.add_done_callback(functools.partial(self._log_background_error, action))
+        return task
+
+    def _log_background_error(self, action: str, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.logger.error(f"Discord error while {action}. Error: {error}")
+
+    def _resolve_config(self, config: Dict) -> ResolvedConfig:
+        """
+        Builds the resolved configuration of a guild from its stored config, filling in the defaults.
+        :param config: Stored Soapbox config of the guild.
+        :return: Resolved configuration of the guild.
+        """
+        suffix: Optional[str] = config.get("suffix")
+        max_channels: Optional[int] = config.get("user_max_channels")
+        return ResolvedConfig(
+            suffix=self.DEFAULT_SOAPBOX_SUFFIX if suffix is None else suffix,
+            max_channels=self.DEFAULT_MAX_USER_SOAPBOXES if max_channels is None else max_channels,
+            trigger_channel_id=config.get("trigger_channel"),
+            category_id=config.get("category"),
+        )
+
+    def _get_resolved_config(self, guild: discord.Guild) -> ResolvedConfig:
+        """
+        Retrieves the resolved configuration of the guild, or the defaults if Soapbox is not configured for it.
+        :param guild: Guild for which to get the configuration.
+        :return: Resolved configuration of the guild.
+        """
+        return self._resolved.get(guild.id, self._default_resolved)
+
+    def _scan_managed_channels(self, guild: discord.Guild) -> Set[int]:
+        """
+        Collects the IDs of the existing Soapbox channels of the guild: the voice channels in its Soapbox category
+        which have its Soapbox suffix.
+        :param guild: Guild for which to scan the Soapbox category.
+        :return: Set of the Soapbox channel IDs.
+        """
+        category = self._get_soapbox_category(guild=guild)
+        if category is None:
+            return set()
+        return {vc.id for vc in self._check_delete_channels(category=category)}
+
     def _get_soapbox_suffix(self, guild: discord.Guild) -> str:
         """
         Retrieves the specified guild's Soapbox channel suffix.
         :param guild: Guild for which to get the Soapbox channel suffix.
-        :return: Guild's Soapbox channel suffix. None if there isn't one set.
+        :return: Guild's Soapbox channel suffix, or the default if there isn't one set.
         """
-        suffix: Optional[str] = self.guild_config_cache.get(guild.id, {}).get("suffix")
-        if suffix is None:
-            self.logger.debug(f"Suffix not found in the cache for Guild {guild.id}. Returning default.")
-            return self.DEFAULT_SOAPBOX_SUFFIX
-        return suffix
+        return self._get_resolved_config(guild=guild).suffix
 
     def _get_max_user_channels(self, guild: discord.Guild) -> int:
         """
@@ -75,26 +198,7 @@ class Soapbox(SepCog):
         :param guild: Guild for which to get the max user channels setting.
         :return: Int, max number of user Soapbox channels.
         """
-        max_chan: Optional[int] = self.guild_config_cache.get(guild.id, {}).get("user_max_channels")
-        if max_chan is None:
-            self.logger.debug(f"Max user channels is not in the cache for Guild {guild.id}. Returning default.")
-            return self.DEFAULT_MAX_USER_SOAPBOXES
-        return max_chan
-
-    def _get_soapbox_channel(self, guild: discord.Guild) -> Optional[discord.CategoryChannel]:
-        """
-        Retrieves the specified guild's Soapbox channel which triggers Soapbox.
-        :param guild: Guild for which to get the Soapbox channel.
-        :return: Guild's Soapbox channel. None if there isn't one set.
-        """
-        channel_id = self.guild_config_cache.get(guild.id, {}).get("trigger_channel")
-        if channel_id is None:
-            return None
-
-        channel = guild.get_channel(channel_id)
-        if channel is None:
-            self.logger.error(f"Soapbox channel no longer exists! Guild: {guild.id} | Channel ID: {channel_id})")
-        return channel
+        return self._get_resolved_config(guild=guild).max_channels
 
     def _get_soapbox_category(self, guild: discord.Guild) -> Optional[discord.CategoryChannel]:
         """
@@ -102,16 +206,21 @@ class Soapbox(SepCog):
         :param guild: Guild for which to get the Soapbox category.
         :return: Guild's Soapbox category. None if there isn't one set.
         """
-        category_id = self.guild_config_cache.get(guild.id, {}).get("category")
-        if category_id is None:
+        config = self._resolved.get(guild.id)
+        if config is None or config.category_id is None:
             return None
+        if config.category is not None:
+            return config.category
 
-        category = guild.get_channel(category_id)
+        category = guild.get_channel(config.category_id)
         if category is None:
-            self.logger.error(f"Soapbox category no longer exists! Guild: {guild.id} | " f"Category ID: {category_id}")
+            self.logger.error(
+                f"Soapbox category no longer exists! Guild: {guild.id} | " f"Category ID: {config.category_id}"
+            )
+        config.category = category
         return category
 
-    async def _set_soapbox_config(self, channel: discord.VoiceChannel, category: discord.CategoryChannel) -> None:
+    def _set_soapbox_config(self, channel: discord.VoiceChannel, category: discord.CategoryChannel) -> None:
         """
         Updates the guild's configuration in the cache and database with the specified trigger
         channel and category for the Soapbox channels.
@@ -120,19 +229,20 @@ class Soapbox(SepCog):
         :return: None
         """
         guild: discord.Guild = channel.guild
-        guild_cache = {
-            "trigger_channel": channel.id,
-            "category": category.id,
-            "user_max_channels": self._get_max_user_channels(guild=guild),
-            "suffix": self._get_soapbox_suffix(guild=guild),
-        }
-        self.guild_config_cache[guild.id] = guild_cache
-        await self.config.guild(guild).config.set(guild_cache)
+        current = self._get_resolved_config(guild=guild)
+        self._resolved[guild.id] = ResolvedConfig(
+            suffix=current.suffix,
+            max_channels=current.max_channels,
+            trigger_channel_id=channel.id,
+            category_id=category.id,
+        )
+        self._managed_channels[guild.id] = self._scan_managed_channels(guild=guild)
+        self._mark_guild_dirty(guild=guild, keys=("trigger_channel", "category"))
         self.logger.info(
             f"Updated the configuration for Guild {guild.id} | Category: {category.id} | " f"Channel: {channel.id}"
         )
 
-    async def _set_single_soapbox_config(
+    def _set_single_soapbox_config(
         self, guild: discord.Guild, key: str, value: Union[int, float, str, List, Dict, None]
     ) -> None:
         """
@@ -145,35 +255,21 @@ class Soapbox(SepCog):
         :return: None
         """
 
-        guild_cache: Dict = self.guild_config_cache.get(guild.id, {})
-        guild_cache[key] = value
+        guild_config = self._get_resolved_config(guild=guild).to_config()
+        guild_config[key] = value
 
-        self.guild_config_cache[guild.id] = guild_cache
-        await self.config.guild(guild).config.set(self.guild_config_cache.get(guild.id))
+        self._resolved[guild.id] = self._resolve_config(config=guild_config)
+        self._managed_channels[guild.id] = self._scan_managed_channels(guild=guild)
+        self._mark_guild_dirty(guild=guild, keys=(key,))
         self.logger.info(f"Updated single config for Guild: {guild.id} | key: {key} | value: {value}")
 
-    @staticmethod
-    def _channel_is_empty(channel: discord.VoiceChannel) -> bool:
-        vc = channel.guild.get_channel(channel_id=channel.id)
-        return len(vc.members) == 0
-
-    def _has_soapbox_suffix(self, channel: discord.VoiceChannel) -> bool:
-        """
-        Checks if the channel has the soapbox suffix.
-        :param channel: Voice channel to check.
-        :return: Boolean indicating whether it has the Soapbox suffix.
-        """
-        return channel.name.endswith(self._get_soapbox_suffix(guild=channel.guild))
-
     def _is_soapbox_channel(self, channel: discord.VoiceChannel) -> bool:
         """
         Checks if the channel is a Soapbox channel.
         :param channel: Voice channel to check!
         :return: Boolean indicating whether it is a Soapbox channel.
         """
-        return channel.category == self._get_soapbox_category(guild=channel.guild) and self._has_soapbox_suffix(
-            channel=channel
-        )
+        return channel.id in self._managed_channels.get(channel.guild.id, self._NO_CHANNELS)
 
     def _should_delete_channel(self, channel: discord.VoiceChannel):
         """
@@ -181,7 +277,8 @@ class Soapbox(SepCog):
         :param channel: Channel to check
         :return: Boolean whether it is eligible to be deleted.
         """
-        return self._is_soapbox_channel(channel=channel) and self._channel_is_empty(channel=channel)
+        # the membership test rules out most channels before the member list is built
+        return self._is_soapbox_channel(channel=channel) and not channel.members
 
     def _check_delete_channels(
         self, category: discord.CategoryChannel = None, guild: discord.Guild = None
@@ -206,25 +303,32 @@ class Soapbox(SepCog):
         if category is None:
             voice_channels = guild.voice_channels
         else:
-            voice_channels = [c for c in category.channels if isinstance(c, discord.VoiceChannel)]
-        return [vc for vc in voice_channels if self._has_soapbox_suffix(channel=vc)]
+            guild = category.guild
+            voice_channels = category.voice_channels
+        suffix = self._get_soapbox_suffix(guild=guild)
+        return [vc for vc in voice_channels if vc.name.endswith(suffix)]
 
-    async def _get_soapbox_channel_name(self, member: discord.Member) -> Optional[str]:
+    def _get_soapbox_channel_name(self, member: discord.Member) -> Optional[str]:
         """
         Returns the name of the Soapbox channel which will be created for the user.
         If the member has reached their maximum channel limit, it will return None
         :param member: Member for which to create the Soapbox channel.
         :return: New channel name. None if the user has hit their max channels.
         """
-        max_channel = self._get_max_user_channels(guild=member.guild)
-        suffix = self._get_soapbox_suffix(guild=member.guild)
+        config = self._get_resolved_config(guild=member.guild)
+        max_channel = config.max_channels
+        prefix = f"{member.display_name} #"
+        suffix = f" {config.suffix}"
 
+        existing_names = {vc.name for vc in member.guild.voice_channels}
         for i in range(1, max_channel + 1):
-            channel_name = f"{member.display_name} #{i} {suffix}"
-            channel_exists = discord.utils.get(member.guild.voice_channels, name=channel_name)
-            if not channel_exists:
+            channel_name = f"{prefix}{i}{suffix}"
+            if channel_name not in existing_names:
                 return channel_name
-        await member.send(f"You're only allowed to have {max_channel} voice channels.")
+        self._run_in_background(
+            member.send(f"You're only allowed to have {max_channel} voice channels."),
+            action=f"notifying Member {member.id} of their Soapbox channel limit",
+        )
         return None  # the user has hit their maximum
 
     async def _create_soapbox_channel(
@@ -239,7 +343,7 @@ class Soapbox(SepCog):
         try:
             guild: discord.Guild = category.guild
 
-            channel_name = await self._get_soapbox_channel_name(member=member)
+            channel_name = self._get_soapbox_channel_name(member=member)
             if channel_name is None:
                 message = f"Member {member.id} is not allowed to create more Soapbox channels"
                 return Result(success=False, error=message, value=None)
@@ -247,6 +351,7 @@ class Soapbox(SepCog):
             new_vc: discord.VoiceChannel = await guild.create_voice_channel(
                 category=category, name=channel_name, reason="Created by Soapbox Cog."
             )
+            self._managed_channels.setdefault(guild.id, set()).add(new_vc.id)
             self.logger.info(f"Created new Soapbox channel. Guild: {guild.id} | Member: {member} | " f"VC: {new_vc.id}")
             return Result(success=True, value=new_vc, error=None)
         except discord.HTTPException as e:
@@ -288,7 +393,11 @@ class Soapbox(SepCog):
                 name="_DEL_{}".format(member.display_name)
             )
             await self._move_member_to_channel(member=member, channel=kick_channel)
-            await kick_channel.delete(reason="Soapbox kick channel. Deleting temporary kick channel.")
+            # nothing depends on the kick channel being gone, so the delete is not waited on
+            self._run_in_background(
+                kick_channel.delete(reason="Soapbox kick channel. Deleting temporary kick channel."),
+                action=f"deleting Soapbox kick channel {kick_channel.id}",
+            )
             self.logger.info(
                 f"Deleting kick channel. Guild: {member.guild.id} | "
                 f"Member: {member} | Channel ID: {kick_channel.id}"
@@ -337,7 +446,14 @@ class Soapbox(SepCog):
         if before.channel == after.channel:
             return  # edge case, do nothing
 
-        if after.channel is not None and after.channel == self._get_soapbox_channel(guild=member.guild):
+        config = self._resolved.get(member.guild.id)
+        if config is None and member.guild.id not in self._loaded_guilds:
+            await self._ensure_loaded(guild=member.guild)
+            config = self._resolved.get(member.guild.id)
+        if config is None or config.trigger_channel_id is None:
+            return  # Soapbox is not configured for the guild
+
+        if after.channel is not None and after.channel.id == config.trigger_channel_id:
             category = self._get_soapbox_category(member.guild)
             if not category:
                 self.logger.error(f"Soapbox category has not been configured for guild {after.channel.guild.id}")
@@ -346,10 +462,19 @@ class Soapbox(SepCog):
             if not result.success:
                 self.logger.error(f"{result.error}" f"Guild: {category.guild} | Category ID: {category.id}")
                 return
-            return await self._create_channel_and_move(category=category, member=member)
+
+            # duplicate voice state events for the same join must not create a second channel
+            key = (member.guild.id, member.id)
+            if key in self._creating:
+                return
+            self._creating.add(key)
+            try:
+                return await self._create_channel_and_move(category=category, member=member)
+            finally:
+                self._creating.discard(key)
 
         if before.channel is not None:
-            if self._is_soapbox_channel(channel=before.channel) and self._channel_is_empty(before.channel):
+            if self._should_delete_channel(channel=before.channel):
                 result = bot_can_manage_category(before.channel.category)
                 if not result.success:
                     self.logger.error(
@@ -360,6 +485,7 @@ class Soapbox(SepCog):
                     return
                 try:
                     await before.channel.delete(reason="Deleted by Soapbox Cog. Channel was empty.")
+                    self._managed_channels.get(before.channel.guild.id, set()).discard(before.channel.id)
                     self.logger.info(
                         f"Soapbox channel is empty. Deleting channel. "
                         f"Guild: {before.channel.guild.id} | "
@@ -379,7 +505,8 @@ class Soapbox(SepCog):
                      with the default suffix. To see a list of channels it would delete,
                      type `[p]soapbox check`.
         """
-        pass
+        # every subcommand reads or updates the guild's config, so make sure it is loaded first
+        await self._ensure_loaded(guild=ctx.guild)
 
     @soapbox.command(name="config", aliases=["configure"])
     @commands.guild_only()
@@ -418,10 +545,11 @@ class Soapbox(SepCog):
 
         if del_channels:
             # format a confirmation reply
-            confirm_message = "**The following channels are __at risk__ of being deleted:**\n"
-            for index, channel in enumerate(del_channels):
-                confirm_message += f"\n{index+1}. `{channel.name}`"
-            confirm_message += "\nAre you sure you wish to proceed?"
+            channel_list = "\n".join(f"{index}. `{channel.name}`" for index, channel in enumerate(del_channels, 1))
+            confirm_message = (
+                "**The following channels are __at risk__ of being deleted:**\n\n"
+                f"{channel_list}\nAre you sure you wish to proceed?"
+            )
 
             confirm_embed = SoapboxEmbedReply(message=confirm_message, title="Channel Check").build()
             confirmed = await InteractiveActions.yes_or_no_action(ctx=ctx, embed=confirm_embed)
@@ -429,7 +557,7 @@ class Soapbox(SepCog):
             if not confirmed:
                 await ContextWrapper(ctx).cross()
                 return
-        await self._set_soapbox_config(channel=trigger_channel, category=target_category)
+        self._set_soapbox_config(channel=trigger_channel, category=target_category)
         success_message = (
             "Great! Soapbox has been configured for:\n\n"
             f"**Trigger Channel:** `{trigger_channel.name}`\n"
@@ -476,7 +604,7 @@ class Soapbox(SepCog):
             await ContextWrapper(ctx).cross()
             return await SoapboxErrorReply(result.error).send(ctx)
 
-        await self._set_single_soapbox_config(guild=ctx.guild, key=key, value=value)
+        self._set_single_soapbox_config(guild=ctx.guild, key=key, value=value)
         success_message = "The following configuration has been updated:\n\n" f"**{key_name}:** {value_name}"
         await SoapboxSuccessReply(message=success_message, title=f"Configured {key_name}").send(ctx)
         await ctx.tick()
@@ -571,9 +699,8 @@ class Soapbox(SepCog):
         del_channels = self._check_delete_channels(category=None, guild=ctx.guild)
 
         if del_channels:
-            message = "**The following channels are __at risk__ of being deleted:**\n"
-            for index, channel in enumerate(del_channels):
-                message += f"\n{index + 1}. `{channel.name}`"
+            channel_list = "\n".join(f"{index}. `{channel.name}`" for index, channel in enumerate(del_channels, 1))
+            message = f"**The following channels are __at risk__ of being deleted:**\n\n{channel_list}"
 
             return await SoapboxEmbedReply(message=message, title="Channel Check").send(ctx)
         else:
@@ -584,3 +711,13 @@ class Soapbox(SepCog):
                 f"before activating Soapbox."
             )
             return await SoapboxErrorReply(message=message, title="Channel Check").send(ctx)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        """
+        Drops the cached Soapbox category of the guild when it is deleted, and forgets deleted Soapbox channels.
+        """
+        config = self._resolved.get(channel.guild.id)
+        if config is not None and config.category is not None and config.category.id == channel.id:
+            config.category = None
+        self._managed_channels.get(channel.guild.id, set()).discard(channel.id)
@@ -0,0 +1,24 @@
+import functools
+import inspect
+
+
+def requires_sl_api(func):
+    """
+    Decorator for Streamlabs commands which need the guild's Streamlabs API. Looks the API up before the command
+    runs and passes it as the argument after ctx, or tells the user Streamlabs is not configured for the guild.
+    The command's signature is exposed without the sl_api argument, so it isn't parsed from the user's input.
+    :param func: Command callback taking (self, ctx, sl_api, ...).
+    :return: Wrapped command callback taking (self, ctx, ...).
+    """
+
+    @functools.wraps(func)
+    async def wrapper(self, ctx, *args, **kwargs):
+        sl_api = self._get_sl_api_or_none(ctx=ctx)
+        if sl_api is None:
+            return await self._send_unconfigured(ctx=ctx)
+        return await func(self, ctx, sl_api, *args, **kwargs)
+
+    signature = inspect.signature(func)
+    parameters = list(signature.parameters.values())
+    wrapper.__signature__ = signature.replace(parameters=parameters[:2] + parameters[3:])
+    return wrapper
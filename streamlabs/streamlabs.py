@@ -1,4 +1,6 @@
-from typing import Dict, List
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 import discord
 
@@ -6,22 +8,28 @@ from cog_shared.seplib.cog import SepCog
 from cog_shared.seplib.replies import ErrorReply
 from cog_shared.seplib.utils import ContextWrapper
 from cog_shared.streamlabsapi.api import SLAPI
-from cog_shared.streamlabsapi.commands.streamlabs_config import StreamlabsConfig
 from cog_shared.streamlabsapi.replies import StreamlabsReply
 from cog_shared.streamlabsapi.seplib.utils import Result
 from redbot.core import Config, checks, commands
 from redbot.core.bot import Red
 from redbot.core.commands import Context
 from cog_shared.streamlabsapi.api.enums import CurrencyCode
+from .checks import requires_sl_api
 
 
 class Streamlabs(SepCog):
+
+    DONATIONS_PAGE_SIZE = 100
+    DONATIONS_CACHE_TTL = 15
+    DONATIONS_CACHE_SIZE = 64
+
     def __init__(self, bot: Red):
         super(Streamlabs, self).__init__(bot=bot)
 
         self.guild_config_cache: Dict[int, Dict[str, object]] = {}
         self.guild_auth_cache: Dict[int, Dict[str, str]] = {}
         self.sl_api: Dict[int, SLAPI] = {}
+        self._donations_cache: OrderedDict = OrderedDict()
 
         self._ensure_futures()
 
@@ -34,33 +42,25 @@ class Streamlabs(SepCog):
 
         guilds = await self.config.all_guilds()
 
-        guild_config = {}
-        guild_auth = {}
-
-        for guild_id, guild_dit in guilds.items():
-            config = guild_dit.get("config")
-            auth = guild_dit.get("auth")
-
-            if config:
-                guild_config[guild_id] = config
-
-            if auth:
-                guild_auth[guild_id] = auth
-
-        self.guild_config_cache = guild_config
-        self.guild_auth_cache = guild_auth
-
-        for guild_id, guild_auth in self.guild_auth_cache.items():
-            self._refresh_streamlabs_api(guild_id=guild_id, guild_auth=guild_auth)
-
-    def _guild_is_configured(self, guild_id: int) -> bool:
-        return guild_id in self.guild_auth_cache and "access_token" in self.guild_auth_cache.get(guild_id)
+        self.guild_config_cache = {
+            guild_id: guild_dict["config"] for guild_id, guild_dict in guilds.items() if guild_dict.get("config")
+        }
+        guild_auth_cache = {
+            guild_id: guild_dict["auth"] for guild_id, guild_dict in guilds.items() if guild_dict.get("auth")
+        }
+        self.guild_auth_cache = guild_auth_cache
+        self.sl_api = {
+            guild_id: SLAPI(access_token=guild_auth["access_token"])
+            for guild_id, guild_auth in guild_auth_cache.items()
+            if "access_token" in guild_auth
+        }
 
     def _refresh_streamlabs_api(self, guild_id: int, guild_auth: Dict) -> None:
-        if self._guild_is_configured(guild_id=guild_id):
-            self.sl_api[guild_id] = SLAPI(access_token=guild_auth.get("access_token"))
+        access_token = guild_auth.get("access_token")
+        if not access_token:
+            self.logger.info(f"No Streamlabs API access token found for guild: {guild_id}")
             return
-        self.logger.info(f"No Streamlabs API access token found for guild: {guild_id}")
+        self.sl_api[guild_id] = SLAPI(access_token=access_token)
 
     def _register_config_entities(self, config: Config):
         # register configuration for guilds in Soapbox
@@ -70,20 +70,35 @@ class Streamlabs(SepCog):
     def _get_guild_auth(self, guild: discord.Guild):
         return self.guild_auth_cache.get(guild.id, None)
 
-    async def _update_guild_auth(self, guild: discord.Guild, auth: Dict):
-        self.guild_auth_cache[guild.id] = auth
-        await self.config.guild(guild=guild).auth.set(auth)
-        self.logger.info(f"Updated Auth config for Guild: {guild.name}|{guild.id}.")
+    async def _update_guild_auth(self, guild_id: int, guild_auth: Dict):
+        """
+        Updates the auth of a single guild in the cache and database. Only the changed guild is written.
+        :param guild_id: ID of the guild whose auth changed.
+        :param guild_auth: New auth of the guild.
+        :return: None
+        """
+        self.guild_auth_cache[guild_id] = guild_auth
+        await self.config.guild(guild=discord.Object(id=guild_id)).auth.set(guild_auth)
+        self.logger.info(f"Updated Auth config for Guild: {guild_id}.")
 
-    async def _check_command_guild_configured(self, ctx: Context):
-        sl_api = self.sl_api.get(ctx.guild.id)
-        if sl_api is None:
-            await ErrorReply(
-                message=f"Streamlabs is not configured for this guild. Run `{ctx.prefix}streamlabs config`"
-            ).send(ctx)
-            await ContextWrapper(ctx).cross()
-            return False
-        return sl_api
+    def _get_sl_api_or_none(self, ctx: Context) -> Optional[SLAPI]:
+        """
+        Gets the Streamlabs API of the command's guild. Plain dict lookup, so commands don't await anything for it.
+        :param ctx: Command context.
+        :return: Streamlabs API of the guild, or None if Streamlabs is not configured for it.
+        """
+        return self.sl_api.get(ctx.guild.id)
+
+    async def _send_unconfigured(self, ctx: Context) -> None:
+        """
+        Tells the user that Streamlabs is not configured for the guild.
+        :param ctx: Command context.
+        :return: None
+        """
+        await ErrorReply(
+            message=f"Streamlabs is not configured for this guild. Run `{ctx.prefix}streamlabs config`"
+        ).send(ctx)
+        await ContextWrapper(ctx).cross()
 
     @commands.group(name="streamlabs")
     @checks.admin_or_permissions()
@@ -99,6 +114,8 @@ class Streamlabs(SepCog):
         """
         Explains the full process for configuring the Streamlabs cog. RUN THIS BEFORE CONFIGURING!
         """
+        from cog_shared.streamlabsapi.commands.streamlabs_config import StreamlabsConfig
+
         return await StreamlabsConfig.config_guide(ctx=ctx)
 
     @streamlabs.command(name="config")
@@ -109,9 +126,11 @@ class Streamlabs(SepCog):
 
         Be sure to run [p]streamlabs guide to fully understand how the process works.
         """
+        from cog_shared.streamlabsapi.commands.streamlabs_config import StreamlabsConfig
+
         updated_auth = await StreamlabsConfig.start_config(ctx=ctx, timeout=timeout)
         if updated_auth:
-            await self._update_guild_auth(guild=ctx.guild, auth=updated_auth)
+            await self._update_guild_auth(guild_id=ctx.guild.id, guild_auth=updated_auth)
 
     @streamlabs.command(name="continue")
     @checks.admin_or_permissions()
@@ -121,11 +140,14 @@ class Streamlabs(SepCog):
 
         This must only be run after [p]streamlabs config has been successfully run.
         """
+        from cog_shared.streamlabsapi.commands.streamlabs_config import StreamlabsConfig
+
         updated_auth = await StreamlabsConfig.continue_config(
             ctx=ctx, timeout=timeout, auth_data=self._get_guild_auth(ctx.guild)
         )
         if updated_auth:
-            await self._update_guild_auth(auth=updated_auth, guild=ctx.guild)
+            await self._update_guild_auth(guild_id=ctx.guild.id, guild_auth=updated_auth)
+            await ctx.tick()
             self._refresh_streamlabs_api(guild_id=ctx.guild.id, guild_auth=updated_auth)
 
     @streamlabs.group(name="alert")
@@ -138,7 +160,8 @@ class Streamlabs(SepCog):
 
     @streamlabs_alert.command(name="follow")
     @checks.admin_or_permissions()
-    async def streamlabs_alert_follow(self, ctx: Context, *, message: str):
+    @requires_sl_api
+    async def streamlabs_alert_follow(self, ctx: Context, sl_api: SLAPI, *, message: str):
         """
         Trigger a follow-type alert on Streamlabs.
 
@@ -149,14 +172,12 @@ class Streamlabs(SepCog):
 
         This text will be highlighted with the secondary color specified in your Streamlabs configuration.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
         await sl_api.alerts.create_alert(type_="follow", message=message)
 
     @streamlabs_alert.command(name="subscription")
     @checks.admin_or_permissions()
-    async def streamlabs_alert_subscription(self, ctx: Context, message: str, user_message: str):
+    @requires_sl_api
+    async def streamlabs_alert_subscription(self, ctx: Context, sl_api: SLAPI, message: str, user_message: str):
         """
         Trigger a subscription-type alert on Streamlabs.
 
@@ -169,14 +190,12 @@ class Streamlabs(SepCog):
 
         The user_message is the sub-text that will display under the primary message.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
         await sl_api.alerts.create_alert(type_="subscription", message=message, user_message=user_message)
 
     @streamlabs_alert.command(name="donation")
     @checks.admin_or_permissions()
-    async def streamlabs_alert_donation(self, ctx: Context, message: str, user_message: str):
+    @requires_sl_api
+    async def streamlabs_alert_donation(self, ctx: Context, sl_api: SLAPI, message: str, user_message: str):
         """
         Trigger a donation-type alert on Streamlabs.
 
@@ -189,14 +208,12 @@ class Streamlabs(SepCog):
 
         The user_message is the sub-text that will display under the primary message.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
         await sl_api.alerts.create_alert(type_="donation", message=message, user_message=user_message)
 
     @streamlabs_alert.command(name="host")
     @checks.admin_or_permissions()
-    async def streamlabs_alert_host(self, ctx: Context, *, message: str):
+    @requires_sl_api
+    async def streamlabs_alert_host(self, ctx: Context, sl_api: SLAPI, *, message: str):
         """
         Trigger a host-type alert on Streamlabs.
 
@@ -207,24 +224,31 @@ class Streamlabs(SepCog):
 
         This text will be highlighted with the secondary color specified in your Streamlabs configuration.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
         await sl_api.alerts.create_alert(type_="host", message=message)
 
+    async def _run_alert_op(self, ctx: Context, method: str, action: str) -> None:
+        """
+        Common method for the alert commands which call a parameterless SLAPI alerts method and tick on success.
+        :param ctx: Context for the command that was called.
+        :param method: Name of the method of the SLAPI alerts API to call.
+        :param action: Description of the action, used in the error message (eg, "muting the alert volume").
+        :return: None
+        """
+        sl_api = self._get_sl_api_or_none(ctx=ctx)
+        if sl_api is None:
+            return await self._send_unconfigured(ctx=ctx)
+        result = await getattr(sl_api.alerts, method)()
+        if not result.success:
+            return await ErrorReply(message=f"There was an error {action}: {result.error}").send(ctx)
+        await ctx.tick()
+
     @streamlabs_alert.command(name="mute")
     @checks.admin_or_permissions()
     async def streamlabs_alert_mute(self, ctx: Context):
         """
         Mute sound on all streamlabs alerts until the `[p]streamlabs alert unmute` command is run.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.mute_volume()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error muting the alert volume: {result.error}").send(ctx)
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="mute_volume", action="muting the alert volume")
 
     @streamlabs_alert.command(name="unmute")
     @checks.admin_or_permissions()
@@ -232,13 +256,7 @@ class Streamlabs(SepCog):
         """
         Unmute sound on all streamlabs alerts.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.unmute_volume()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error unmuting the alert volume: {result.error}").send(ctx)
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="unmute_volume", action="unmuting the alert volume")
 
     @streamlabs_alert.command(name="pause")
     @checks.admin_or_permissions()
@@ -246,13 +264,7 @@ class Streamlabs(SepCog):
         """
         Pause all Streamlabs alerts until the `[p]streamlabs alert unpause` command is run.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.pause_queue()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error pausing the alert queue: {result.error}").send(ctx)
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="pause_queue", action="pausing the alert queue")
 
     @streamlabs_alert.command(name="unpause")
     @checks.admin_or_permissions()
@@ -260,13 +272,7 @@ class Streamlabs(SepCog):
         """
         Unpause the Streamlabs alert queue. This will allow the alerts which were paused to flow again.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.unpause_queue()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error unpausing the alert queue: {result.error}").send(ctx)
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="unpause_queue", action="unpausing the alert queue")
 
     @streamlabs_alert.command(name="show_video")
     @checks.admin_or_permissions()
@@ -274,15 +280,7 @@ class Streamlabs(SepCog):
         """
         Toggle showing Streamlabs Media Share videos in the alert box.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.show_video()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error showing the Media Share video: {result.error}").send(
-                ctx
-            )
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="show_video", action="showing the Media Share video")
 
     @streamlabs_alert.command(name="hide_video")
     @checks.admin_or_permissions()
@@ -290,15 +288,7 @@ class Streamlabs(SepCog):
         """
         Hides Streamlabs Media Share videos in the alert box.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-        result = await sl_api.alerts.hide_video()
-        if not result.success:
-            return await ErrorReply(message=f"There was an error hiding the Media Share video: {result.error}").send(
-                ctx
-            )
-        await ctx.tick()
+        return await self._run_alert_op(ctx=ctx, method="hide_video", action="hiding the Media Share video")
 
     @streamlabs.group(name="donations")
     @checks.admin_or_permissions()
@@ -309,9 +299,9 @@ class Streamlabs(SepCog):
         pass
 
     async def _base_send_test_alert(self, ctx: Context, type_, platform: str = None) -> None:
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
+        sl_api = self._get_sl_api_or_none(ctx=ctx)
+        if sl_api is None:
+            return await self._send_unconfigured(ctx=ctx)
         result = await sl_api.alerts.send_test_alert(type_=type_, platform=platform)
         if not result.success:
             return await ErrorReply(message=f"There was an Error sending a {type_} test alert: {result.error}").send(
@@ -381,11 +371,80 @@ class Streamlabs(SepCog):
         """
         await self._base_send_test_alert(ctx=ctx, type_="bits", platform=platform)
 
+    async def _get_donations(
+        self, sl_api: SLAPI, limit: Optional[int], before: Optional[int], after: Optional[int], **filters
+    ) -> List[Dict]:
+        """
+        Gets up to `limit` donations, paging through the Streamlabs API when more than a single page is requested.
+        Pages are chained on the ID of the last donation of the previous page, so they are fetched one after another.
+        :param sl_api: Streamlabs API of the guild.
+        :param limit: Maximum number of donations to get.
+        :param before: Limits the donations to those before a certain donation ID.
+        :param after: Limits the donations to those after a certain donation ID.
+        :param filters: Remaining get_donations filters, passed through as-is.
+        :return: List of donations, newest first.
+        """
+        if not limit or limit <= self.DONATIONS_PAGE_SIZE:
+            donations = await sl_api.donations.get_donations(limit=limit, before=before, after=after, **filters)
+            return donations.get("data") or []
+
+        donations_list: List[Dict] = []
+        while len(donations_list) < limit:
+            page_limit = min(self.DONATIONS_PAGE_SIZE, limit - len(donations_list))
+            donations = await sl_api.donations.get_donations(limit=page_limit, before=before, after=after, **filters)
+            page = donations.get("data") or []
+            donations_list.extend(page)
+            if len(page) < page_limit:
+                break
+            before = page[-1].get("donation_id")
+            if before is None:
+                break
+        return donations_list
+
+    def _get_cached_donations(self, key: Tuple) -> Optional[List[Dict]]:
+        """
+        Gets a donations listing from the cache, if it was fetched less than DONATIONS_CACHE_TTL seconds ago.
+        :param key: Guild ID followed by the listing's query parameters.
+        :return: Cached list of donations, or None on a miss.
+        """
+        cached = self._donations_cache.get(key)
+        if cached is None:
+            return None
+        fetched_at, donations_list = cached
+        if time.monotonic() - fetched_at >= self.DONATIONS_CACHE_TTL:
+            del self._donations_cache[key]
+            return None
+        self._donations_cache.move_to_end(key)
+        return donations_list
+
+    def _cache_donations(self, key: Tuple, donations_list: List[Dict]) -> None:
+        """
+        Caches a donations listing, evicting the least recently used listing once DONATIONS_CACHE_SIZE is exceeded.
+        :param key: Guild ID followed by the listing's query parameters.
+        :param donations_list: List of donations to cache.
+        :return: None
+        """
+        self._donations_cache[key] = (time.monotonic(), donations_list)
+        self._donations_cache.move_to_end(key)
+        if len(self._donations_cache) > self.DONATIONS_CACHE_SIZE:
+            self._donations_cache.popitem(last=False)
+
+    def _invalidate_donations_cache(self, guild_id: int) -> None:
+        """
+        Drops every cached donations listing of the guild.
+        :param guild_id: ID of the guild whose donations changed.
+        :return: None
+        """
+        for key in [key for key in self._donations_cache if key[0] == guild_id]:
+            del self._donations_cache[key]
+
     @streamlabs_donations.command(name="list")
     @checks.admin_or_permissions()
+    @requires_sl_api
     async def streamlabs_donations_list(
         self,
         ctx: Context,
+        sl_api: SLAPI,
         limit: int = None,
         before: int = None,
         after: int = None,
@@ -401,10 +460,6 @@ class Streamlabs(SepCog):
         :param currency: Limits the donations to specified currency code: https://dev.streamlabs.com/docs/currency-codes
         :param verified: Boolean to indicate whether you only want verified donations.
         """
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-
         currency = currency.upper()
         if currency not in CurrencyCode:
             return await ErrorReply(
@@ -412,30 +467,35 @@ class Streamlabs(SepCog):
                 f"Please see https://dev.streamlabs.com/docs/currency-codes for a list of valid codes."
             ).send(ctx)
 
-        donations = await sl_api.donations.get_donations(
-            limit=limit, before=before, after=after, currency=currency, verified=verified
-        )
-        donations_list: List[Dict] = donations.get("data")
+        key = (ctx.guild.id, limit, before, after, currency, verified)
+        donations_list = self._get_cached_donations(key=key)
+        if donations_list is None:
+            async with ctx.typing():
+                donations_list = await self._get_donations(
+                    sl_api=sl_api, limit=limit, before=before, after=after, currency=currency, verified=verified
+                )
+            self._cache_donations(key=key, donations_list=donations_list)
 
         if not donations_list:
             return await StreamlabsReply(
                 message="You have no donations that match that criteria.", title="Donation List"
             ).send(ctx)
         else:
-            message = "Here's a list of the donations that match your criteria:\n\n"
-            for index, donation in enumerate(donations_list):
-                num = index + 1
-                name = donation.get("name")
-                amount = donation.get("amount")
-                currency = donation.get("currency")
-                message += f"{num}. Name: {name} | Amount: {amount} | Currency: {currency}\n"
+            rows = []
+            for num, donation in enumerate(donations_list, 1):
+                get = donation.get
+                rows.append(f"{num}. Name: {get('name')} | Amount: {get('amount')} | Currency: {get('currency')}\n")
+            lines = "".join(rows)
+            message = f"Here's a list of the donations that match your criteria:\n\n{lines}"
             return await StreamlabsReply(message=message, title="Donation List").send(ctx)
 
     @streamlabs_donations.command(name="create")
     @checks.admin_or_permissions()
+    @requires_sl_api
     async def streamlabs_donation_create(
         self,
         ctx: Context,
+        sl_api: SLAPI,
         name: str,
         identifier: str,
         amount: float,
@@ -461,10 +521,6 @@ class Streamlabs(SepCog):
         **skip_alert:** Boolean to indicate whether the alert should be skipped when the donation is posted.
         """
 
-        sl_api = await self._check_command_guild_configured(ctx=ctx)
-        if not sl_api:
-            return
-
         currency = currency.upper()
         if currency not in CurrencyCode:
             return await ErrorReply(
@@ -472,15 +528,17 @@ class Streamlabs(SepCog):
                 f"Please see https://dev.streamlabs.com/docs/currency-codes for a list of valid codes."
             ).send(ctx)
 
-        response = await sl_api.donations.create_donation(
-            name=name,
-            identifier=identifier,
-            amount=amount,
-            currency=currency,
-            message=message,
-            created_at=created_at,
-            skip_alert=skip_alert,
-        )
+        async with ctx.typing():
+            response = await sl_api.donations.create_donation(
+                name=name,
+                identifier=identifier,
+                amount=amount,
+                currency=currency,
+                message=message,
+                created_at=created_at,
+                skip_alert=skip_alert,
+            )
         if isinstance(response, Result) and not response.success:
             return await ErrorReply(message=f"Error from the Streamlabs API: {response.error}").send(ctx)
+        self._invalidate_donations_cache(guild_id=ctx.guild.id)
         await StreamlabsReply(message=f"Donation created with ID: {response}", title="Donation Created").send(ctx)